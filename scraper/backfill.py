@@ -0,0 +1,38 @@
+# backfill.py
+import argparse
+import logging
+
+import db
+from config import config
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Canonicalize listing and frontier URLs, then recompute derived listing fields "
+                    "(search terms, numeric price, rating and house details) for existing documents, "
+                    "in batches."
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--rebuild-facets", action="store_true",
+                        help="recount the facet catalogue from every listing")
+    parser.add_argument("--skip-rollups", action="store_true",
+                        help="don't recompute the region, country and feature statistics")
+    args = parser.parse_args()
+
+    db.ensure_indexes(config.DB_NAME, config.COLLECTION_NAME)
+    rewritten, removed = db.canonicalize_urls(config.DB_NAME, config.COLLECTION_NAME, args.batch_size)
+    logging.info(f"{rewritten} listing URLs canonicalized, {removed} duplicates removed")
+    updated = db.backfill_derived_fields(config.DB_NAME, config.COLLECTION_NAME, args.batch_size)
+    logging.info(f"Backfill complete, {updated} listings updated")
+
+    # Removed duplicates leave the facet counts stale
+    if args.rebuild_facets or removed:
+        db.rebuild_facets(config.DB_NAME, config.COLLECTION_NAME)
+    if not args.skip_rollups:
+        db.rebuild_rollups(config.DB_NAME, config.COLLECTION_NAME)
+
+
+if __name__ == "__main__":
+    main()
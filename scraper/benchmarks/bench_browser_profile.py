@@ -0,0 +1,97 @@
+# A/B comparison of the stock Chrome session and the light scraping profile on
+# local fixture listing pages: pages per minute, and resident memory of the
+# chromedriver + Chrome process tree (read from /proc, so Linux only).
+#
+#   cd scraper && python -m benchmarks.bench_browser_profile --pages 40
+import argparse
+import os
+import time
+
+from selenium.webdriver.support.ui import WebDriverWait
+
+import browser as browser_profiles
+import extract
+from benchmarks.fixture_server import FixtureServer
+from readiness import document_ready
+
+
+def child_pids():
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ')'
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    return children
+
+
+def process_tree_rss(pid):
+    children = child_pids()
+    pending, total = [pid], 0
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def run_profile(profile, urls):
+    browser = browser_profiles.create_browser(profile)
+    try:
+        pid = browser.service.process.pid
+        peak_rss = 0
+        extracted = 0
+        start = time.monotonic()
+        for url in urls:
+            browser.get(url)
+            WebDriverWait(browser, 30).until(document_ready)
+            extracted += extract.extract_place(browser.page_source, url) is not None
+            peak_rss = max(peak_rss, process_tree_rss(pid))
+        elapsed = time.monotonic() - start
+        final_rss = process_tree_rss(pid)
+    finally:
+        browser.quit()
+    return {
+        "pages_per_minute": len(urls) / elapsed * 60,
+        "peak_rss": peak_rss,
+        "final_rss": final_rss,
+        "extracted": extracted,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the default and light Chrome profiles on fixture pages.")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--profiles", nargs="+", default=["default", "light"], choices=browser_profiles.PROFILES)
+    args = parser.parse_args()
+
+    with FixtureServer() as server:
+        urls = [server.url(f"/rooms/{room_id}") for room_id in range(1, args.pages + 1)]
+        print(f"Loading {args.pages} fixture listings per profile from {server.base_url}")
+        results = {}
+        for profile in args.profiles:
+            results[profile] = result = run_profile(profile, urls)
+            print(f"{profile:<8} {result['pages_per_minute']:8.1f} pages/min   "
+                  f"peak RSS {result['peak_rss'] / 1024 / 1024:7.1f} MiB   "
+                  f"final RSS {result['final_rss'] / 1024 / 1024:7.1f} MiB   "
+                  f"extracted {result['extracted']}/{len(urls)}")
+
+    if "default" in results and "light" in results:
+        baseline, light = results["default"], results["light"]
+        print(f"light profile: {light['pages_per_minute'] / baseline['pages_per_minute']:.2f}x pages/min, "
+              f"{(baseline['peak_rss'] - light['peak_rss']) / 1024 / 1024:.1f} MiB less peak RSS")
+
+
+if __name__ == "__main__":
+    main()
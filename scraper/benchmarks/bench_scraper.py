@@ -0,0 +1,211 @@
+# End-to-end scraping benchmark against the fixture pages served from localhost
+# by benchmarks/fixture_server.py: paginated search results, listing pages and
+# the amenities modal. Runs get_place_urls, scrape_place_details and
+# scrape_region and reports listings per second, per-stage and per-field
+# latency and peak memory. Listings are written to an in-memory MongoDB
+# stand-in (mongomock), or with --mongo local to MONGO_CONNECTION_STRING.
+#
+#   cd scraper && python -m benchmarks.bench_scraper --json bench.json
+#   cd scraper && python -m benchmarks.bench_scraper --baseline bench.json
+#
+# With --baseline the run fails when throughput drops or peak memory grows by
+# more than --tolerance, so it can gate changes to main.py.
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import db
+import main as scraper
+import metrics
+from fetch_scheduler import FetchScheduler
+from benchmarks.bench_browser_profile import process_tree_rss
+from benchmarks.fixture_server import FixtureServer
+from pool import BrowserPool
+
+# Result key -> True when higher is better
+GATED_RESULTS = {
+    "discovery.urls_per_second": True,
+    "listings.listings_per_second": True,
+    "region.listings_per_second": True,
+    "peak_rss_mib": False,
+}
+
+
+class PeakRSS(threading.Thread):
+    # Samples the resident memory of this process and every browser it started
+    def __init__(self, interval=0.25):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, process_tree_rss(os.getpid()))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def use_mongo(mode, db_name):
+    if mode == "memory":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--mongo memory needs mongomock (pip install mongomock), or use --mongo local")
+        db.db_manager.client = mongomock.MongoClient()
+    else:
+        db.db_manager.connect().drop_database(db_name)
+    db.ensure_indexes(db_name, scraper.COLLECTION_NAME)
+
+
+def histogram_delta(histogram, before):
+    # Observations made since before was taken: label -> (count, mean ms)
+    delta = {}
+    for values, (count, total) in histogram.totals().items():
+        old_count, old_total = before.get(values, (0, 0.0))
+        if count > old_count:
+            delta[",".join(values)] = (count - old_count, (total - old_total) / (count - old_count) * 1000)
+    return delta
+
+
+def print_latencies(title, latencies):
+    if not latencies:
+        return
+    print(f"  {title}")
+    for name, (count, mean_ms) in sorted(latencies.items(), key=lambda item: -item[1][1]):
+        print(f"    {name:<40} {count:6d} x {mean_ms:9.1f} ms")
+
+
+def bench_discovery(browser, location):
+    start = time.monotonic()
+    urls = scraper.get_place_urls(browser, location)
+    elapsed = time.monotonic() - start
+    print(f"get_place_urls       {len(urls):5d} urls in {elapsed:6.2f}s   {len(urls) / elapsed:7.2f} urls/s")
+    return urls, {"urls": len(urls), "seconds": elapsed, "urls_per_second": len(urls) / elapsed}
+
+
+def bench_listings(browser, urls):
+    stages, fields, waits = (metric.totals() for metric in
+                             (metrics.STAGE_SECONDS, metrics.FIELD_SECONDS, metrics.SELECTOR_WAIT_SECONDS))
+    start = time.monotonic()
+    places = [scraper.scrape_place_details(browser, url) for url in urls]
+    elapsed = time.monotonic() - start
+    complete = sum(1 for place in places if place["title"] and place["price"] and place["features"])
+    print(f"scrape_place_details {len(places):5d} listings in {elapsed:6.2f}s   "
+          f"{len(places) / elapsed:7.2f} listings/s   {complete} with title, price and features")
+
+    result = {
+        "listings": len(places),
+        "complete": complete,
+        "seconds": elapsed,
+        "listings_per_second": len(places) / elapsed,
+        "stage_ms": histogram_delta(metrics.STAGE_SECONDS, stages),
+        "field_ms": histogram_delta(metrics.FIELD_SECONDS, fields),
+        "selector_wait_ms": histogram_delta(metrics.SELECTOR_WAIT_SECONDS, waits),
+    }
+    print_latencies("stages", result["stage_ms"])
+    print_latencies("fields", result["field_ms"])
+    print_latencies("selector waits", result["selector_wait_ms"])
+    return result
+
+
+def bench_region(region, country, workers, fetcher_name):
+    start = time.monotonic()
+    with BrowserPool(scraper.initialize_browser, size=workers) as pool:
+        fetcher = scraper.get_fetcher(pool, {"fetcher": fetcher_name})
+        written = scraper.scrape_region(pool, region, country, fetcher)
+    elapsed = time.monotonic() - start
+    stored = db.db_manager.get_collection(scraper.DB_NAME, scraper.COLLECTION_NAME).count_documents(
+        {"region": region, "country": country})
+    print(f"scrape_region        {written:5d} listings in {elapsed:6.2f}s   "
+          f"{written / elapsed:7.2f} listings/s   {stored} stored   ({workers} workers, {fetcher_name})")
+    return {"listings": written, "stored": stored, "seconds": elapsed, "listings_per_second": written / elapsed}
+
+
+def lookup(results, key):
+    value = results
+    for part in key.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results, baseline, tolerance):
+    failures = []
+    for key, higher_is_better in GATED_RESULTS.items():
+        current, previous = lookup(results, key), lookup(baseline, key)
+        if current is None or not previous:
+            continue
+        change = current / previous - 1
+        worse = change < -tolerance if higher_is_better else change > tolerance
+        print(f"{key:<32} {previous:10.2f} -> {current:10.2f} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+        if worse:
+            failures.append(key)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper end to end against local fixture pages.")
+    parser.add_argument("--search-pages", type=int, default=3)
+    parser.add_argument("--listings-per-page", type=int, default=18)
+    parser.add_argument("--listings", type=int, default=20, help="listings scraped one by one")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--fetcher", default="selenium", choices=["selenium", "http"])
+    parser.add_argument("--extract-mode", default=scraper.EXTRACT_MODE, choices=["source", "elements"])
+    parser.add_argument("--mongo", default="memory", choices=["memory", "local"])
+    parser.add_argument("--db-name", default="airbnb_benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="fail if results regress against this file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    scraper.DB_NAME = args.db_name
+    scraper.EXTRACT_MODE = args.extract_mode
+    # The fixture server needs no politeness; measure the scraper, not the pacing
+    scraper.scheduler = FetchScheduler(rate=1000, burst=1000, max_rate=1000)
+    use_mongo(args.mongo, args.db_name)
+
+    tracemalloc.start()
+    sampler = PeakRSS()
+    sampler.start()
+    with FixtureServer(search_pages=args.search_pages, listings_per_page=args.listings_per_page) as server:
+        scraper.AIRBNB_BASE_URL = server.base_url
+        print(f"Serving fixtures from {server.base_url}, extract mode {args.extract_mode}, {args.mongo} MongoDB")
+        browser = scraper.initialize_browser()
+        try:
+            urls, discovery = bench_discovery(browser, "Toronto, Ontario")
+            listings = bench_listings(browser, urls[:args.listings])
+        finally:
+            browser.quit()
+        region = bench_region("Ontario", "Canada", args.workers, args.fetcher)
+
+    results = {
+        "discovery": discovery,
+        "listings": listings,
+        "region": region,
+        "peak_rss_mib": sampler.stop() / 1024 / 1024,
+        "python_peak_mib": tracemalloc.get_traced_memory()[1] / 1024 / 1024,
+    }
+    tracemalloc.stop()
+    print(f"peak RSS {results['peak_rss_mib']:.1f} MiB (scraper and browsers), "
+          f"Python heap peak {results['python_peak_mib']:.1f} MiB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.tolerance)
+        if failures:
+            sys.exit(f"Regressed beyond {args.tolerance:.0%}: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Compares the old dumps -> loads -> jsonify response path with the single-pass
+# encoder, for a whole result set and for a streamed array.
+#
+#   cd scraper && python -m benchmarks.bench_serialization --listings 10000
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.json_util import dumps
+
+import db
+
+
+def make_listings(count):
+    now = datetime.now(timezone.utc)
+    return [{
+        "_id": ObjectId(),
+        "url": f"https://www.airbnb.com/rooms/{index}",
+        "title": f"Listing {index}",
+        "picture_url": f"https://a0.muscache.com/im/pictures/{index}.jpg",
+        "description": "A bright and quiet place to stay. " * 20,
+        "price": "$1,234 month",
+        "rating": "4.92 · 120 reviews",
+        "location": "Toronto, Ontario, Canada",
+        "features": [f"Feature {feature}" for feature in range(40)],
+        "house_details": ["3 bedrooms", "4 beds", "2 baths"],
+        "region": "Ontario",
+        "country": "Canada",
+        "scraped_at": now,
+    } for index in range(count)]
+
+
+def round_trip(listings):
+    # What the endpoints did before: BSON extended JSON, parsed back, then
+    # serialized again by jsonify
+    return json.dumps(json.loads(dumps(listings)))
+
+
+def single_pass(listings):
+    return json.dumps(listings, cls=db.JSONEncoder)
+
+
+def streamed(listings):
+    encoder = db.JSONEncoder(separators=(',', ':'))
+    size = 0
+    for listing in listings:
+        size += len(encoder.encode(listing)) + 1
+    return size
+
+
+def measure(name, func, listings, repeat):
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.process_time()
+        func(listings)
+        timings.append(time.process_time() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    best = min(timings)
+    print(f"{name:<14} cpu {best * 1000:9.1f} ms   peak memory {peak / 1024 / 1024:8.1f} MiB")
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing response serialization.")
+    parser.add_argument("--listings", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    listings = make_listings(args.listings)
+    print(f"Serializing {args.listings} listings, best of {args.repeat}")
+    baseline_cpu, baseline_peak = measure("round trip", round_trip, listings, args.repeat)
+    for name, func in (("single pass", single_pass), ("streamed", streamed)):
+        cpu, peak = measure(name, func, listings, args.repeat)
+        print(f"{'':<14} saves {(baseline_cpu - cpu) * 1000:.1f} ms cpu "
+              f"and {(baseline_peak - peak) / 1024 / 1024:.1f} MiB per request")
+
+
+if __name__ == "__main__":
+    main()
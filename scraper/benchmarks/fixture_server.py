@@ -0,0 +1,171 @@
+# Serves recorded-style Airbnb pages and their heavy assets from localhost, so
+# scraping can be measured without touching airbnb.com. Search results are
+# paginated through an aria-label="Next" link and listings open their amenities
+# in a modal, like the live site.
+import html
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+PHOTOS_PER_LISTING = 8
+SEARCH_PAGES = 3
+LISTINGS_PER_PAGE = 18
+AMENITIES = ["Wifi", "Kitchen", "Free parking on premises", "Washer", "Dryer", "Air conditioning",
+             "Heating", "Dedicated workspace", "TV", "Hair dryer", "Iron", "Smoke alarm",
+             "Carbon monoxide alarm", "Fire extinguisher", "First aid kit", "Hot tub", "Pool",
+             "EV charger", "Crib", "BBQ grill", "Patio or balcony", "Backyard", "Beach access",
+             "Lake access", "Ski-in/Ski-out"]
+
+
+def png(width, height, seed):
+    # Noise compresses badly, so the image costs about as much to transfer and
+    # decode as a real listing photo
+    rows = []
+    state = seed or 1
+    for _ in range(height):
+        row = bytearray(width * 3)
+        for index in range(0, len(row), 4):
+            state = (state * 1103515245 + 12345) & 0x7fffffff
+            row[index:index + 4] = state.to_bytes(4, "little")[:len(row) - index]
+        rows.append(b"\x00" + bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 1)) + chunk(b"IEND", b""))
+
+
+@lru_cache(maxsize=None)
+def asset(kind, seed):
+    if kind == "photo":
+        return "image/png", png(640, 426, seed)
+    if kind == "font":
+        return "font/woff2", os.urandom(96 * 1024)
+    return "video/mp4", os.urandom(1024 * 1024)
+
+
+@lru_cache(maxsize=None)
+def template(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return Template(f.read())
+
+
+def room_ids(location, page, per_page):
+    # Stable per location, so a region's pages always list the same rooms
+    first = zlib.crc32(location.encode("utf-8")) % 100000 * 1000 + (page - 1) * per_page + 1
+    return range(first, first + per_page)
+
+
+def search_page(location, query, page, pages, per_page):
+    cards = "\n      ".join(
+        f'<div data-testid="card-container"><a class="atm_7l_1j28jx2" href="/rooms/{room_id}?source_impression_id=p3">'
+        f'<img src="/assets/photo-{room_id}-{room_id % PHOTOS_PER_LISTING}.png?im_w=720"></a></div>'
+        for room_id in room_ids(location, page, per_page))
+    next_link = ""
+    if page < pages:
+        next_query = html.escape(urlencode({**query, "page": page + 1}))
+        next_link = f'<a aria-label="Next" href="?{next_query}">Next</a>'
+    return template("search.html").substitute(location=html.escape(location), cards=cards, next_link=next_link)
+
+
+def listing_page(room_id):
+    gallery = "\n    ".join(f'<img class="itu7ddv" src="/assets/photo-{room_id}-{index}.png?im_w=720">'
+                           for index in range(PHOTOS_PER_LISTING))
+    amenities = "\n    ".join(f'<div class="title">{name}</div>' for name in AMENITIES[:10])
+    return template("listing.html").substitute(
+        room_id=room_id,
+        title=f"Bright loft {room_id} near the water",
+        gallery=gallery,
+        location="Toronto, Ontario, Canada",
+        description="A bright and quiet place to stay, close to transit and the lake. " * 6,
+        price=f"${1500 + room_id % 500:,}",
+        amenities_preview=amenities,
+        amenity_count=len(AMENITIES),
+        amenities_json=json.dumps(AMENITIES),
+        # Spread over downtown Toronto
+        latitude=f"{43.63 + room_id % 97 / 1000:.6f}",
+        longitude=f"{-79.42 + room_id % 89 / 1000:.6f}",
+    )
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    routes = [
+        (re.compile(r"^/s/([^/]+)/homes"), "search"),
+        (re.compile(r"^/rooms/(\d+)"), "listing"),
+        (re.compile(r"^/assets/photo-(\d+)-(\d+)\.png"), "photo"),
+        (re.compile(r"^/assets/tour-(\d+)\.mp4"), "video"),
+        (re.compile(r"^/assets/[\w-]+\.woff2"), "font"),
+    ]
+
+    def do_GET(self):
+        for pattern, kind in self.routes:
+            match = pattern.match(self.path)
+            if not match:
+                continue
+            if kind == "search":
+                query = {name: values[0] for name, values in parse_qs(urlsplit(self.path).query).items()}
+                page = int(query.get("page", 1))
+                body = search_page(unquote(match.group(1)), query, page, self.server.search_pages,
+                                   self.server.listings_per_page).encode("utf-8")
+                return self.respond("text/html; charset=utf-8", body)
+            if kind == "listing":
+                body = listing_page(int(match.group(1))).encode("utf-8")
+                return self.respond("text/html; charset=utf-8", body)
+            # Every listing gets the same few photos, sent with no-store so the
+            # browser downloads them again on each page
+            seed = int(match.group(2)) if kind == "photo" else 0
+            return self.respond(*asset(kind, seed))
+        self.send_error(404)
+
+    def respond(self, content_type, body):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    def __init__(self, host="127.0.0.1", port=0, search_pages=SEARCH_PAGES, listings_per_page=LISTINGS_PER_PAGE):
+        self.server = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.server.daemon_threads = True
+        self.server.search_pages = search_pages
+        self.server.listings_per_page = listings_per_page
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fixture-server", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path):
+        return self.base_url + path
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
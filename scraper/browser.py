@@ -0,0 +1,70 @@
+import logging
+import os
+
+from selenium import webdriver
+
+logger = logging.getLogger(__name__)
+
+# 'light' is the tuned scraping profile; 'default' is a stock Chrome session,
+# kept for comparison and for debugging with a visible window
+BROWSER_PROFILE = os.getenv('SCRAPER_BROWSER_PROFILE', 'light')
+HEADLESS = os.getenv('SCRAPER_HEADLESS', 'true').lower() == 'true'
+WINDOW_SIZE = os.getenv('SCRAPER_WINDOW_SIZE', '1280,900')
+# Seconds a page load may take before it raises TimeoutException, which the
+# fetch scheduler retries
+PAGE_LOAD_TIMEOUT = float(os.getenv('SCRAPER_PAGE_LOAD_TIMEOUT', 30))
+
+# Only the src attribute of the listing picture is scraped, so images, fonts and
+# media are never downloaded. Image URLs usually carry a query string (?im_w=720).
+BLOCKED_RESOURCE_PATTERNS = [
+    "*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*",
+    "*.woff*", "*.ttf*", "*.otf*",
+    "*.mp4*", "*.webm*", "*.m3u8*", "*.mp3*",
+    "*muscache.com/im/*",
+]
+BLOCKED_TRACKER_PATTERNS = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*googleadservices.com*",
+    "*facebook.net*", "*facebook.com/tr*", "*connect.facebook.net*", "*bat.bing.com*",
+    "*analytics.tiktok.com*", "*ads-twitter.com*", "*static.ads-twitter.com*", "*hotjar.com*",
+    "*branch.io*", "*px-cloud.net*", "*sentry.io*",
+]
+# Extra patterns, comma separated
+EXTRA_BLOCKED_PATTERNS = [pattern for pattern in os.getenv('SCRAPER_BLOCKED_URLS', '').split(',') if pattern]
+
+PROFILES = ('light', 'default')
+
+
+def chrome_options(profile=BROWSER_PROFILE):
+    options = webdriver.ChromeOptions()
+    if profile == 'default':
+        return options
+    if HEADLESS:
+        options.add_argument("--headless=new")
+    options.add_argument(f"--window-size={WINDOW_SIZE}")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--mute-audio")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.default_content_setting_values.notifications": 2,
+    })
+    return options
+
+
+def block_resources(browser, patterns):
+    # Requests matching a pattern fail in the network stack before any bytes
+    # are fetched
+    browser.execute_cdp_cmd("Network.enable", {})
+    browser.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+
+
+def create_browser(profile=BROWSER_PROFILE):
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown browser profile: {profile}")
+    browser = webdriver.Chrome(options=chrome_options(profile))
+    browser.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    if profile == 'light':
+        block_resources(browser, BLOCKED_RESOURCE_PATTERNS + BLOCKED_TRACKER_PATTERNS + EXTRA_BLOCKED_PATTERNS)
+    return browser
@@ -0,0 +1,208 @@
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone
+
+from bson import Binary
+from flask import request, make_response, Response
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# 'memory' keeps responses in this process; 'mongo' shares them between
+# processes through a collection
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 3600))
+# How often the shared data version is re-read. Writes made by this process
+# are seen immediately.
+DATA_VERSION_POLL_SECONDS = float(os.getenv('DATA_VERSION_POLL_SECONDS', 2))
+# Streamed responses are passed through as they are generated and stored once
+# complete; one that grows past this many bytes is served but not cached, so a
+# large listing page never has to sit in memory whole
+RESPONSE_CACHE_MAX_STREAM_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_STREAM_KB', 2048)) * 1024
+
+CacheEntry = namedtuple('CacheEntry', ['body', 'mimetype', 'etag'])
+
+
+class MemoryCacheBackend:
+    # Size-bounded LRU
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class MongoCacheBackend:
+    # Shared by every process using the same database. Entries expire through
+    # a TTL index; superseded data versions are never read again.
+    def __init__(self, db_name, collection_name='response_cache', ttl=RESPONSE_CACHE_TTL):
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.ttl = ttl
+        self.indexed = False
+
+    def collection(self):
+        collection = db.db_manager.get_collection(self.db_name, self.collection_name)
+        if not self.indexed:
+            collection.create_index("expires_at", expireAfterSeconds=0)
+            self.indexed = True
+        return collection
+
+    def get(self, key):
+        document = self.collection().find_one({"_id": key})
+        if document is None:
+            return None
+        return CacheEntry(bytes(document["body"]), document["mimetype"], document["etag"])
+
+    def set(self, key, entry):
+        self.collection().replace_one({"_id": key}, {
+            "body": Binary(entry.body),
+            "mimetype": entry.mimetype,
+            "etag": entry.etag,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+        }, upsert=True)
+
+    def clear(self):
+        self.collection().delete_many({})
+
+
+class DataVersion:
+    # Counter bumped by every listing write (see DatabaseManager.upsert_many).
+    # Cached responses are keyed on it, so a write makes them all unreachable.
+    def __init__(self, db_name, poll_seconds=DATA_VERSION_POLL_SECONDS):
+        self.db_name = db_name
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self.value = None
+        self.read_at = 0.0
+        self.seen_local_writes = None
+
+    def current(self):
+        with self.lock:
+            local_writes = db.db_manager.local_writes
+            if (self.value is not None and local_writes == self.seen_local_writes
+                    and time.monotonic() - self.read_at < self.poll_seconds):
+                return self.value
+        value = db.get_data_version(self.db_name)
+        with self.lock:
+            self.value = value
+            self.read_at = time.monotonic()
+            self.seen_local_writes = local_writes
+        return value
+
+
+def make_etag(version, body):
+    return f"{version}-{hashlib.sha1(body).hexdigest()[:20]}"
+
+
+class ResponseCache:
+    def __init__(self, backend, version, max_stream_bytes=RESPONSE_CACHE_MAX_STREAM_BYTES):
+        self.backend = backend
+        self.version = version
+        self.max_stream_bytes = max_stream_bytes
+
+    def key(self, version):
+        # Normalized so that parameter order and repeated values in a different
+        # order hit the same entry
+        args = "&".join(f"{name}={','.join(sorted(request.args.getlist(name)))}"
+                        for name in sorted(request.args))
+        return f"{version}:{request.path}?{args}"
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                version = self.version.current()
+                key = self.key(version)
+                entry = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Response cache unavailable, serving {request.path} uncached: {e}")
+                return view(*args, **kwargs)
+
+            cache_status = "HIT"
+            if entry is None:
+                cache_status = "MISS"
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    # Its ETag is only known at the end, so this first copy goes
+                    # out without one
+                    response.response = self.store_streamed(response.response, key, version, response.mimetype,
+                                                            request.path)
+                    response.headers["Cache-Control"] = "no-cache"
+                    response.headers["X-Cache"] = cache_status
+                    return response
+                body = response.get_data()
+                entry = CacheEntry(body, response.mimetype, make_etag(version, body))
+                self.store(key, entry, request.path)
+
+            if request.if_none_match.contains(entry.etag):
+                response = Response(status=304)
+            else:
+                response = Response(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+            # Clients may keep the body but must revalidate it with If-None-Match
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["X-Cache"] = cache_status
+            return response
+        return wrapper
+
+    def store(self, key, entry, path):
+        try:
+            self.backend.set(key, entry)
+        except Exception as e:
+            logger.warning(f"Could not store {path} in the response cache: {e}")
+
+    def store_streamed(self, chunks, key, version, mimetype, path):
+        # Yields the body unchanged and caches it once it is complete. A stream
+        # that is abandoned, fails or outgrows max_stream_bytes is not cached.
+        parts, size = [], 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if parts is not None:
+                size += len(chunk)
+                if size <= self.max_stream_bytes:
+                    parts.append(chunk)
+                else:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            body = b"".join(parts)
+            self.store(key, CacheEntry(body, mimetype, make_etag(version, body)), path)
+
+
+def create_response_cache(db_name, backend=RESPONSE_CACHE_BACKEND):
+    if backend == 'mongo':
+        cache_backend = MongoCacheBackend(db_name)
+    elif backend == 'memory':
+        cache_backend = MemoryCacheBackend()
+    else:
+        raise ValueError(f"Unknown response cache backend: {backend}")
+    logger.info(f"Using the {backend} response cache backend")
+    return ResponseCache(cache_backend, DataVersion(db_name))
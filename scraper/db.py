@@ -1,41 +1,152 @@
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import MongoClient, UpdateOne, ReplaceOne, ASCENDING, DESCENDING, GEOSPHERE, monitoring
+from pymongo.errors import ConnectionFailure, OperationFailure, DuplicateKeyError, PyMongoError
+from datetime import datetime, timezone
 from bson import ObjectId
 import logging
 import json
-from bson.json_util import dumps
+import os
+import threading
+import time
+import normalize
+import facets
+import sharding
+import rollups
 from sqlalchemy.orm.collections import collection
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class JSONEncoder(json.JSONEncoder):
+    # Lets documents straight from pymongo be serialized in one pass
     def default(self, o):
         if isinstance(o, ObjectId):
             return str(o)
+        if isinstance(o, datetime):
+            if o.tzinfo is None:
+                # pymongo returns naive datetimes that are in UTC
+                o = o.replace(tzinfo=timezone.utc)
+            return o.isoformat()
         return json.JSONEncoder.default(self, o)
 
+def without_id(document):
+    return {key: value for key, value in document.items() if key != "_id"}
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    # Connection pool counters for the health endpoint. Events arrive on driver
+    # and application threads, so updates are taken under a lock.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.total_wait += event.duration
+            self.max_wait = max(self.max_wait, event.duration)
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+            self.total_wait += event.duration
+            self.max_wait = max(self.max_wait, event.duration)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.closed += 1
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.pool_clears += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
 class DatabaseManager:
+    # Owns one MongoClient for the whole process. The client is created on first
+    # use and shared by every thread; pymongo's connection pool does the rest.
     def __init__(self, connection_string):
         self.connection_string = connection_string
         self.client = None
-        self.db = None
+        self.lock = threading.Lock()
+        self.pool_monitor = PoolMonitor()
+        self.facet_cache = facets.TTLCache()
+        # db_name -> (region, country) pairs written since their rollup was refreshed
+        self.dirty_regions = {}
+        # Data version bumps made by this process, so caches here can notice
+        # them without a round trip
+        self.local_writes = 0
 
     def connect(self):
-        try:
-            self.client = MongoClient(self.connection_string)
-            # The ismaster command is cheap and does not require auth.
-            self.client.admin.command('ismaster')
-            logging.info("Successfully connected to the database.")
-        except ConnectionFailure:
-            logging.error("Server not available. Failed to connect to the database.")
-            raise
+        if self.client:
+            return self.client
+        with self.lock:
+            if self.client:
+                return self.client
+            client = None
+            try:
+                client = MongoClient(
+                    self.connection_string,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    event_listeners=[self.pool_monitor]
+                )
+                # The ping command is cheap and does not require auth.
+                client.admin.command('ping')
+                logging.info("Successfully connected to the database.")
+            except ConnectionFailure:
+                logging.error("Server not available. Failed to connect to the database.")
+                if client:
+                    client.close()
+                raise
+            self.client = client
+            return client
 
     def get_database(self, db_name):
-        if not self.client:
-            self.connect()
-        self.db = self.client[db_name]
-        return self.db
+        return self.connect()[db_name]
 
     def get_collection(self, db_name, collection_name):
         db = self.get_database(db_name)
@@ -51,52 +162,412 @@ class DatabaseManager:
             logging.error(f"An error occurred while inserting documents: {e}")
             raise
 
-    def get_listings(self, db_name, collection_name, query=None, limit=10):
+    def ensure_listing_indexes(self, db_name, collection_name):
         collection = self.get_collection(db_name, collection_name)
         try:
-            logging.debug(f"Executing query: {query}, limit: {limit}")
-            cursor = collection.find(query or {}).limit(limit)
-            results = list(cursor)
-            logging.debug(f"Found {len(results)} results")
-            return json.loads(dumps(results))  # Convert to JSON-serializable format
+            collection.create_index([("url", ASCENDING)], unique=True, name="url_unique")
+        except DuplicateKeyError:
+            # Listings written before urls were unique; keep the newest copy of each
+            removed = self.remove_duplicate_urls(db_name, collection_name)
+            logging.warning(f"Removed {removed} duplicate listings before creating the url index")
+            collection.create_index([("url", ASCENDING)], unique=True, name="url_unique")
+
+        # Search fields written by upsert_many; see normalize.derived_fields
+        collection.create_index([("location_terms", ASCENDING)], name="location_terms")
+        collection.create_index([("region_norm", ASCENDING)], name="region_norm")
+        collection.create_index([("country_norm", ASCENDING)], name="country_norm")
+        collection.create_index([("features", ASCENDING)], name="features")
+        collection.create_index([("derived_version", ASCENDING)], name="derived_version")
+        for field in ("price_value", "rating_value", "bedrooms", "beds", "baths", "guests"):
+            collection.create_index([(field, ASCENDING)], name=field)
+        collection.create_index([("thumbnail", ASCENDING)], name="thumbnail", sparse=True)
+        # Listings without a position have geo null and are left out of the index
+        collection.create_index([("geo", GEOSPHERE)], name="geo")
+
+        frontier = self.get_collection(db_name, FRONTIER_COLLECTION)
+        frontier.create_index([("region", ASCENDING), ("country", ASCENDING), ("state", ASCENDING)])
+        self.get_collection(db_name, ROLLUPS_COLLECTION).create_index(
+            [("kind", ASCENDING), ("count", DESCENDING)], name="kind_count")
+        logging.info("Listing and frontier indexes are in place.")
+
+    def backfill_derived_fields(self, db_name, collection_name, batch_size=500):
+        # Recomputes derived fields for listings written before the current
+        # normalize.DERIVED_VERSION, one batch of bulk updates at a time.
+        collection = self.get_collection(db_name, collection_name)
+        query = {"$or": [{"derived_version": {"$exists": False}},
+                         {"derived_version": {"$lt": normalize.DERIVED_VERSION}}]}
+        projection = {field: 1 for field in normalize.SOURCE_FIELDS}
+        updated = 0
+        while True:
+            documents = list(collection.find(query, projection).limit(batch_size))
+            if not documents:
+                break
+            operations = [UpdateOne({"_id": document["_id"]}, {"$set": normalize.derived_fields(document)})
+                          for document in documents]
+            collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            logging.info(f"Backfilled derived fields for {updated} listings")
+        if updated:
+            self.bump_data_version(db_name)
+        return updated
+
+    def bump_data_version(self, db_name):
+        self.get_collection(db_name, META_COLLECTION).update_one(
+            {"_id": "data_version"}, {"$inc": {"value": 1}}, upsert=True
+        )
+        with self.lock:
+            self.local_writes += 1
+
+    def get_data_version(self, db_name):
+        document = self.get_collection(db_name, META_COLLECTION).find_one({"_id": "data_version"})
+        return document["value"] if document else 0
+
+    def remove_duplicate_urls(self, db_name, collection_name):
+        collection = self.get_collection(db_name, collection_name)
+        pipeline = [
+            {"$sort": {"_id": -1}},
+            {"$group": {"_id": "$url", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ]
+        removed = 0
+        for group in collection.aggregate(pipeline, allowDiskUse=True):
+            result = collection.delete_many({"_id": {"$in": group["ids"][1:]}})
+            removed += result.deleted_count
+        return removed
+
+    def canonicalize_urls(self, db_name, collection_name, batch_size=500):
+        # Listings and frontier entries written before sharding.canonical_url
+        # keep their query-string URLs, so the unique url index never merges
+        # them with the canonical copies. Rewrites them, keeping the newest
+        # listing of each canonical URL and the frontier entry already stored
+        # under it. Returns (listings rewritten, listings removed).
+        collection = self.get_collection(db_name, collection_name)
+        rewritten = removed = 0
+        after = None
+        while True:
+            query = {"url": {"$regex": NON_CANONICAL_URL}}
+            if after is not None:
+                query["_id"] = {"$gt": after}
+            documents = list(collection.find(query, {"url": 1}).sort("_id", ASCENDING).limit(batch_size))
+            if not documents:
+                break
+            after = documents[-1]["_id"]
+            groups = {}
+            for document in documents:
+                url = sharding.canonical_url(document["url"])
+                if url != document["url"]:
+                    groups.setdefault(url, []).append(document["_id"])
+            for existing in collection.find({"url": {"$in": list(groups)}}, {"url": 1}):
+                groups[existing["url"]].append(existing["_id"])
+            for url, ids in groups.items():
+                newest = max(ids)
+                stale = [_id for _id in ids if _id != newest]
+                if stale:
+                    removed += collection.delete_many({"_id": {"$in": stale}}).deleted_count
+                rewritten += collection.update_one(
+                    {"_id": newest, "url": {"$ne": url}}, {"$set": {"url": url}}).modified_count
+
+        # A frontier _id can't be changed in place, so each entry is copied to its
+        # canonical URL unless one is already there, then deleted
+        frontier = self.get_collection(db_name, FRONTIER_COLLECTION)
+        moved = 0
+        after = None
+        while True:
+            query = {"_id": {"$regex": NON_CANONICAL_URL}}
+            if after is not None:
+                query["_id"]["$gt"] = after
+            entries = list(frontier.find(query).sort("_id", ASCENDING).limit(batch_size))
+            if not entries:
+                break
+            after = entries[-1]["_id"]
+            entries = [entry for entry in entries if sharding.canonical_url(entry["_id"]) != entry["_id"]]
+            canonical = {sharding.canonical_url(entry["_id"]) for entry in entries}
+            stored = {doc["_id"] for doc in frontier.find({"_id": {"$in": list(canonical)}}, {"_id": 1})}
+            for entry in entries:
+                url = sharding.canonical_url(entry["_id"])
+                if url not in stored:
+                    frontier.insert_one({**entry, "_id": url})
+                    stored.add(url)
+            if entries:
+                moved += frontier.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}}).deleted_count
+
+        if rewritten or removed:
+            self.bump_data_version(db_name)
+        if rewritten or removed or moved:
+            logging.info(f"Canonicalized listing URLs: {rewritten} rewritten, {removed} duplicates removed, "
+                         f"{moved} frontier entries moved")
+        return rewritten, removed
+
+    def upsert_many(self, db_name, collection_name, documents, key="url"):
+        collection = self.get_collection(db_name, collection_name)
+        now = datetime.now(timezone.utc)
+        keys = [document[key] for document in documents]
+        try:
+            # The stored versions are needed to keep the facet counts in step, and
+            # derived fields are computed from the stored listing merged with the
+            # write, since fields the write lacks (a city scrape has no region)
+            # are kept
+            projection = {"url": 1, **{field: 1 for field in facets.FACET_FIELDS.values()},
+                          **{field: 1 for field in normalize.SOURCE_FIELDS}}
+            previous = {doc["url"]: doc for doc in collection.find({key: {"$in": keys}}, projection)}
+            operations = [
+                UpdateOne({key: document[key]},
+                          {"$set": {**without_id(document),
+                                    **normalize.derived_fields({**previous.get(document[key], {}), **document}),
+                                    "scraped_at": now},
+                           "$setOnInsert": {"first_seen": now}},
+                          upsert=True)
+                for document in documents
+            ]
+            result = collection.bulk_write(operations, ordered=False)
+            logging.info(f"Upserted {result.upserted_count} new and updated {result.modified_count} documents.")
+            self.update_facets(db_name, facets.facet_delta(previous, documents))
+            self.mark_regions_dirty(db_name, list(previous.values()) + documents)
+            self.bump_data_version(db_name)
+            return [str(doc["_id"]) for doc in collection.find({key: {"$in": keys}}, {"_id": 1})]
+        except OperationFailure as e:
+            logging.error(f"An error occurred while upserting documents: {e}")
+            raise
+
+    def update_facets(self, db_name, delta):
+        if not delta:
+            return
+        catalogue = self.get_collection(db_name, FACETS_COLLECTION)
+        operations = [
+            UpdateOne({"_id": facets.facet_id(kind, value)},
+                      {"$inc": {"count": change}, "$setOnInsert": {"kind": kind, "value": value}},
+                      upsert=True)
+            for (kind, value), change in delta.items()
+        ]
+        catalogue.bulk_write(operations, ordered=False)
+        catalogue.delete_many({"count": {"$lte": 0}})
+        self.facet_cache.invalidate(db_name)
+
+    def rebuild_facets(self, db_name, collection_name):
+        # Recounts the whole catalogue from the listings; the incremental updates
+        # in upsert_many keep it current afterwards
+        collection = self.get_collection(db_name, collection_name)
+        catalogue = self.get_collection(db_name, FACETS_COLLECTION)
+        counts = self.count_facets(collection, {})
+        documents = [
+            {"_id": facets.facet_id(kind, value), "kind": kind, "value": value, "count": count}
+            for kind, group in facets.FACET_GROUPS.items()
+            for value, count in counts[group].items()
+        ]
+        catalogue.delete_many({})
+        if documents:
+            catalogue.insert_many(documents)
+        self.facet_cache.invalidate(db_name)
+        self.bump_data_version(db_name)
+        logging.info(f"Rebuilt facet catalogue with {len(documents)} entries")
+        return len(documents)
+
+    def ensure_facets(self, db_name, collection_name):
+        if self.get_collection(db_name, FACETS_COLLECTION).estimated_document_count() == 0:
+            self.rebuild_facets(db_name, collection_name)
+
+    def count_facets(self, collection, query):
+        # Per-facet listing counts for the listings matching query, in one pass
+        pipeline = [{"$match": query}] if query else []
+        pipeline.append({"$facet": {
+            "features": [{"$unwind": "$features"}, {"$group": {"_id": "$features", "count": {"$sum": 1}}}],
+            "regions": [{"$group": {"_id": "$region", "count": {"$sum": 1}}}],
+            "countries": [{"$group": {"_id": "$country", "count": {"$sum": 1}}}],
+        }})
+        result = next(collection.aggregate(pipeline, allowDiskUse=True), {})
+        return {group: {doc["_id"]: doc["count"] for doc in result.get(group, []) if doc["_id"]}
+                for group in facets.FACET_GROUPS.values()}
+
+    def get_facet_catalogue(self, db_name):
+        def load():
+            catalogue = facets.empty_catalogue()
+            for doc in self.get_collection(db_name, FACETS_COLLECTION).find():
+                catalogue[facets.FACET_GROUPS[doc["kind"]]][doc["value"]] = doc["count"]
+            return catalogue
+        return self.facet_cache.get(db_name, load)
+
+    def mark_regions_dirty(self, db_name, documents):
+        regions = {(document.get("region"), document.get("country")) for document in documents
+                   if document.get("region")}
+        with self.lock:
+            self.dirty_regions.setdefault(db_name, set()).update(regions)
+
+    def save_rollups(self, db_name, documents):
+        if documents:
+            self.get_collection(db_name, ROLLUPS_COLLECTION).bulk_write(
+                [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in documents],
+                ordered=False)
+
+    def refresh_rollups(self, db_name, collection_name):
+        # Recomputes the rollups of the regions written to since the last
+        # refresh, each from its own listings. Country and feature rollups span
+        # too many listings for that and are left to rebuild_rollups.
+        with self.lock:
+            regions = self.dirty_regions.pop(db_name, set())
+        if not regions:
+            return 0
+        collection = self.get_collection(db_name, collection_name)
+        projection = {field: 1 for field in rollups.ROLLUP_FIELDS}
+        documents, empty = [], []
+        for region, country in regions:
+            listings = list(collection.find({"region": region, "country": country}, projection))
+            computed = rollups.compute_rollups(rollups.ListingColumns(listings), kinds=("region",))
+            documents.extend(computed)
+            if not computed:
+                empty.append(rollups.rollup_id("region", region, country))
+        self.save_rollups(db_name, documents)
+        if empty:
+            self.get_collection(db_name, ROLLUPS_COLLECTION).delete_many({"_id": {"$in": empty}})
+        self.bump_data_version(db_name)
+        logging.info(f"Refreshed rollups of {len(regions)} regions")
+        return len(regions)
+
+    def rebuild_rollups(self, db_name, collection_name):
+        # Recomputes every region, country and feature rollup from one pass over
+        # the listings
+        start = time.monotonic()
+        with self.lock:
+            self.dirty_regions.pop(db_name, None)
+        collection = self.get_collection(db_name, collection_name)
+        projection = {field: 1 for field in rollups.ROLLUP_FIELDS}
+        columns = rollups.ListingColumns(collection.find({}, projection, batch_size=5000))
+        documents = rollups.compute_rollups(columns)
+        self.save_rollups(db_name, documents)
+        self.get_collection(db_name, ROLLUPS_COLLECTION).delete_many(
+            {"_id": {"$nin": [document["_id"] for document in documents]}})
+        self.bump_data_version(db_name)
+        logging.info(f"Rebuilt {len(documents)} rollups from {len(columns)} listings "
+                     f"in {time.monotonic() - start:.1f}s")
+        return len(documents)
+
+    def ensure_rollups(self, db_name, collection_name):
+        if self.get_collection(db_name, ROLLUPS_COLLECTION).estimated_document_count() == 0:
+            self.rebuild_rollups(db_name, collection_name)
+
+    def get_rollup(self, db_name, kind, region=None, country=None, feature=None):
+        return self.get_collection(db_name, ROLLUPS_COLLECTION).find_one(
+            {"_id": rollups.rollup_id(kind, region, country, feature)}, {"_id": 0})
+
+    def get_rollups(self, db_name, kind, limit=100):
+        cursor = self.get_collection(db_name, ROLLUPS_COLLECTION).find(
+            {"kind": kind}, {"_id": 0}).sort("count", DESCENDING).limit(limit)
+        return list(cursor)
+
+    def add_to_frontier(self, db_name, urls, region, country):
+        # A URL stays with the region that found it first, so one that several
+        # regions' searches return is not handed back and forth between them
+        frontier = self.get_collection(db_name, FRONTIER_COLLECTION)
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne({"_id": url},
+                      {"$set": {"discovered_at": now},
+                       "$setOnInsert": {"region": region, "country": country, "state": "pending", "attempts": 0,
+                                        "last_scraped": None}},
+                      upsert=True)
+            for url in urls
+        ]
+        if operations:
+            frontier.bulk_write(operations, ordered=False)
+
+    def get_frontier_urls(self, db_name, region, country, stale_before, urls=None):
+        # Of the given urls, or else of every URL the region owns
+        frontier = self.get_collection(db_name, FRONTIER_COLLECTION)
+        query = {
+            # Dead letters are left alone until someone looks at them
+            "state": {"$ne": "dead"},
+            "$or": [{"state": {"$ne": "done"}}, {"last_scraped": {"$lt": stale_before}}]
+        }
+        if urls is not None:
+            query["_id"] = {"$in": list(urls)}
+        else:
+            query.update({"region": region, "country": country})
+        return [doc["_id"] for doc in frontier.find(query, {"_id": 1})]
+
+    def mark_frontier(self, db_name, urls, state, error=None):
+        frontier = self.get_collection(db_name, FRONTIER_COLLECTION)
+        urls = list(urls)
+        update = {"$set": {"state": state, "error": error}, "$inc": {"attempts": 1}}
+        if state == "done":
+            update["$set"]["last_scraped"] = datetime.now(timezone.utc)
+            update["$set"]["failures"] = 0
+        else:
+            update["$inc"]["failures"] = 1
+        frontier.update_many({"_id": {"$in": urls}}, update)
+        if state == "failed":
+            # URLs that kept failing across runs stop being retried
+            dead = frontier.update_many(
+                {"_id": {"$in": urls}, "state": "failed", "failures": {"$gte": DEAD_LETTER_FAILURES}},
+                {"$set": {"state": "dead", "dead_at": datetime.now(timezone.utc)}}
+            )
+            if dead.modified_count:
+                logging.warning(f"Moved {dead.modified_count} URLs to the dead-letter state after "
+                                f"{DEAD_LETTER_FAILURES} failed runs")
+
+    def get_dead_letters(self, db_name, limit=100):
+        frontier = self.get_collection(db_name, FRONTIER_COLLECTION)
+        cursor = frontier.find({"state": "dead"}).sort("dead_at", -1).limit(limit)
+        return [{"url": doc["_id"], **without_id(doc)} for doc in cursor]
+
+    def get_region_discovery(self, db_name, region, country):
+        return self.get_collection(db_name, CRAWL_REGIONS_COLLECTION).find_one({"_id": f"{region}|{country}"})
+
+    def mark_region_discovered(self, db_name, region, country, url_count, shards=None):
+        self.get_collection(db_name, CRAWL_REGIONS_COLLECTION).update_one(
+            {"_id": f"{region}|{country}"},
+            {"$set": {"region": region, "country": country, "url_count": url_count,
+                      "shards": shards, "discovered_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def iter_listings(self, db_name, collection_name, query=None, limit=0, after=None, fields=None):
+        # One page of listings in _id order, yielded as the cursor returns them.
+        # after is the _id of the last listing of the previous page.
+        collection = self.get_collection(db_name, collection_name)
+        page_size = min(limit or LISTINGS_DEFAULT_PAGE_SIZE, LISTINGS_MAX_PAGE_SIZE)
+        query = dict(query or {})
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        projection = {field: 1 for field in fields} if fields else {field: 0 for field in INTERNAL_FIELDS}
+        try:
+            logging.debug(f"Executing query: {query}, page size: {page_size}, fields: {fields}")
+            cursor = collection.find(query, projection).sort("_id", ASCENDING).limit(page_size)
+            yield from cursor.batch_size(min(page_size, 100))
         except OperationFailure as e:
             logging.error(f"An error occurred while fetching listings: {e}")
             raise
 
     def get_filters(self, db_name, collection_name, query=None, limit=10):
         collection = self.get_collection(db_name, collection_name)
+        limit = min(limit or LISTINGS_DEFAULT_PAGE_SIZE, LISTINGS_MAX_PAGE_SIZE)
         try:
             logging.debug(f"Executing query: {query}, limit: {limit}")
 
-            # Aggregate to get unique features
-            features_pipeline = [
-                {"$unwind": "$features"},
-                {"$group": {"_id": "$features"}},
-                {"$sort": {"_id": 1}}
-            ]
-            features_cursor = collection.aggregate(features_pipeline)
-            features = [doc["_id"] for doc in features_cursor]
+            # Unique features come from the facet catalogue; counts are scoped
+            # to the query when there is one
+            catalogue = self.get_facet_catalogue(db_name)
+            features = sorted(catalogue["features"])
+            facet_counts = self.count_facets(collection, query) if query else catalogue
 
             # Get the listings based on the query
-            cursor = collection.find(query or {}).limit(limit)
+            cursor = collection.find(query or {}, {field: 0 for field in INTERNAL_FIELDS}).limit(limit)
             listings = list(cursor)
 
             # Prepare the result
             result = {
                 "features": features,
+                "facet_counts": facet_counts,
                 "listings": listings
             }
 
             logging.debug(f"Found {len(listings)} listings and {len(features)} unique features")
-            return json.loads(dumps(result))  # Convert to JSON-serializable format
+            return result
         except OperationFailure as e:
             logging.error(f"An error occurred while fetching filters: {e}")
             raise
 
     def get_regions(self, db_name, collection_name):
-        collection = self.get_collection(db_name, collection_name)
         try:
-            regions = collection.distinct("region")
+            regions = sorted(self.get_facet_catalogue(db_name)["regions"])
             logging.debug(f"Found {len(regions)} distinct regions")
             return regions
         except OperationFailure as e:
@@ -104,93 +575,269 @@ class DatabaseManager:
             raise
 
     def get_countries(self, db_name, collection_name):
-        collection = self.get_collection(db_name, collection_name)
         try:
-            countries = collection.distinct("country")
+            countries = sorted(self.get_facet_catalogue(db_name)["countries"])
             logging.debug(f"Found {len(countries)} distinct countries")
             return countries
         except OperationFailure as e:
             logging.error(f"An error occurred while fetching countries: {e}")
             raise
 
-    def get_listing_by_id(self, db_name, collection_name, listing_id):
+    def set_thumbnail(self, db_name, collection_name, url, digest, source):
+        # Not a change to the listing data, so response caches are left alone
+        self.get_collection(db_name, collection_name).update_one(
+            {"url": url}, {"$set": {"thumbnail": digest, "thumbnail_source": source}})
+
+    def get_thumbnail_state(self, db_name, collection_name, url):
+        return self.get_collection(db_name, collection_name).find_one(
+            {"url": url}, {field: 1 for field in THUMBNAIL_FIELDS})
+
+    def get_listing_by_thumbnail(self, db_name, collection_name, digest):
+        return self.get_collection(db_name, collection_name).find_one(
+            {"thumbnail": digest}, {field: 1 for field in THUMBNAIL_FIELDS})
+
+    def get_listing_by_id(self, db_name, collection_name, listing_id, fields=None):
+        # Without fields, everything but INTERNAL_FIELDS
         collection = self.get_collection(db_name, collection_name)
+        projection = {field: 1 for field in fields} if fields else {field: 0 for field in INTERNAL_FIELDS}
         try:
-            result = collection.find_one({"_id": ObjectId(listing_id)})
-            return json.loads(dumps(result))  # Convert to JSON-serializable format
+            result = collection.find_one({"_id": ObjectId(listing_id)}, projection)
+            return result
         except OperationFailure as e:
             logging.error(f"An error occurred while fetching the listing: {e}")
             raise
 
+    def health(self):
+        status = {}
+        start = time.monotonic()
+        try:
+            self.connect().admin.command('ping')
+            status["status"] = "ok"
+        except PyMongoError as e:
+            status["status"] = "unavailable"
+            status["error"] = str(e)
+        status["ping_ms"] = round((time.monotonic() - start) * 1000, 3)
+        status["pool"] = self.pool_monitor.stats()
+        return status
+
     def close_connection(self):
-        if self.client:
-            self.client.close()
-            logging.info("Database connection closed.")
+        with self.lock:
+            if self.client:
+                self.client.close()
+                self.client = None
+                logging.info("Database connection closed.")
 
 # Usage example
-CONNECTION_STRING = "mongodb://192.168.1.71:27017/?retryWrites=true&loadBalanced=false&serverSelectionTimeoutMS=5000&connectTimeoutMS=10000"
+CONNECTION_STRING = os.getenv('MONGO_CONNECTION_STRING', "mongodb://192.168.1.71:27017/?retryWrites=true&loadBalanced=false&serverSelectionTimeoutMS=5000&connectTimeoutMS=10000")
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 2))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000))
 DB_NAME = "airbnb"
 COLLECTION_NAME = "listings"
+FRONTIER_COLLECTION = "frontier"
+# URLs sharding.canonical_url would rewrite: query strings, fragments and the
+# /rooms/plus/ and /rooms/luxury/ paths
+NON_CANONICAL_URL = r"[?#]|/rooms/(?:plus|luxury)/"
+CRAWL_REGIONS_COLLECTION = "crawl_regions"
+# Consecutive failed runs after which a frontier URL is no longer retried
+DEAD_LETTER_FAILURES = int(os.getenv('SCRAPER_DEAD_LETTER_FAILURES', 3))
+FACETS_COLLECTION = "facets"
+ROLLUPS_COLLECTION = "rollups"
+META_COLLECTION = "meta"
+
+# Listing endpoints return at most LISTINGS_MAX_PAGE_SIZE listings per page
+LISTINGS_DEFAULT_PAGE_SIZE = int(os.getenv('LISTINGS_DEFAULT_PAGE_SIZE', 100))
+LISTINGS_MAX_PAGE_SIZE = int(os.getenv('LISTINGS_MAX_PAGE_SIZE', 500))
+# What list views need to render a listing card
+SUMMARY_FIELDS = ["url", "title", "price", "rating", "picture_url", "location", "region", "country", "geo"]
+# What making and serving a listing's thumbnail needs
+THUMBNAIL_FIELDS = ["url", "picture_url", "thumbnail", "thumbnail_source"]
+# Fields kept for searching, filtering and thumbnails, left out of listings
+# returned without ?fields=; they can still be asked for by name
+INTERNAL_FIELDS = ["location_norm", "location_terms", "region_norm", "country_norm",
+                   "price_value", "price_currency", "price_period", "rating_value", "review_count",
+                   "bedrooms", "beds", "baths", "guests", "geo", "geo_precision", "derived_version",
+                   "thumbnail", "thumbnail_source"]
 
 db_manager = DatabaseManager(CONNECTION_STRING)
 
+def ensure_indexes(db_name, collection_name):
+    try:
+        db_manager.ensure_listing_indexes(db_name, collection_name)
+    except Exception as e:
+        logging.error(f"An error occurred while creating indexes: {e}")
+
+def backfill_derived_fields(db_name, collection_name, batch_size=500):
+    try:
+        return db_manager.backfill_derived_fields(db_name, collection_name, batch_size)
+    except Exception as e:
+        logging.error(f"An error occurred while backfilling listings: {e}")
+        return 0
+
+def canonicalize_urls(db_name, collection_name, batch_size=500):
+    try:
+        return db_manager.canonicalize_urls(db_name, collection_name, batch_size)
+    except Exception as e:
+        logging.error(f"An error occurred while canonicalizing listing URLs: {e}")
+        return 0, 0
+
+def ensure_facets(db_name, collection_name):
+    try:
+        db_manager.ensure_facets(db_name, collection_name)
+    except Exception as e:
+        logging.error(f"An error occurred while building the facet catalogue: {e}")
+
+def rebuild_facets(db_name, collection_name):
+    try:
+        return db_manager.rebuild_facets(db_name, collection_name)
+    except Exception as e:
+        logging.error(f"An error occurred while building the facet catalogue: {e}")
+        return 0
+
+def refresh_rollups(db_name, collection_name):
+    try:
+        return db_manager.refresh_rollups(db_name, collection_name)
+    except Exception as e:
+        logging.error(f"An error occurred while refreshing rollups: {e}")
+        return 0
+
+def rebuild_rollups(db_name, collection_name):
+    try:
+        return db_manager.rebuild_rollups(db_name, collection_name)
+    except Exception as e:
+        logging.error(f"An error occurred while rebuilding rollups: {e}")
+        return 0
+
+def ensure_rollups(db_name, collection_name):
+    try:
+        db_manager.ensure_rollups(db_name, collection_name)
+    except Exception as e:
+        logging.error(f"An error occurred while rebuilding rollups: {e}")
+
+def get_rollup(db_name, kind, region=None, country=None, feature=None):
+    try:
+        return db_manager.get_rollup(db_name, kind, region, country, feature)
+    except Exception as e:
+        logging.error(f"An error occurred while reading rollups: {e}")
+        return None
+
+def get_rollups(db_name, kind, limit=100):
+    try:
+        return db_manager.get_rollups(db_name, kind, limit)
+    except Exception as e:
+        logging.error(f"An error occurred while reading rollups: {e}")
+        return None
+
 def insert_many_into_collection(db_name, collection_name, places):
+    # Listings are keyed on url, so re-scraped listings update their document
+    # instead of adding a duplicate
     try:
-        db_manager.connect()
-        inserted_ids = db_manager.insert_many(db_name, collection_name, places)
+        inserted_ids = db_manager.upsert_many(db_name, collection_name, places)
         return inserted_ids
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         return []
-    finally:
-        db_manager.close_connection()
 
-def get_listings(db_name, collection_name, query=None, limit=0):
+def iter_listings(db_name, collection_name, query=None, limit=0, after=None, fields=None):
+    # Errors are raised when the generator is first advanced, so callers can
+    # still answer with an error before they start streaming
+    return db_manager.iter_listings(db_name, collection_name, query, limit, after, fields)
+
+def get_data_version(db_name):
+    # Raises, so a cache never serves entries for a version it could not read
+    return db_manager.get_data_version(db_name)
+
+def get_listing_by_id(db_name, collection_name, listing_id, fields=None):
     try:
-        db_manager.connect()
-        return db_manager.get_listings(db_name, collection_name, query, limit)
+        return db_manager.get_listing_by_id(db_name, collection_name, listing_id, fields)
     except Exception as e:
-        logging.error(f"An error occurred while fetching listings: {e}")
-        return []
-    finally:
-        db_manager.close_connection()
+        logging.error(f"An error occurred while fetching the listing: {e}")
+        return None
 
-def get_listing_by_id(db_name, collection_name, listing_id):
+def set_thumbnail(db_name, collection_name, url, digest, source):
     try:
-        db_manager.connect()
-        return db_manager.get_listing_by_id(db_name, collection_name, listing_id)
+        db_manager.set_thumbnail(db_name, collection_name, url, digest, source)
+    except Exception as e:
+        logging.error(f"An error occurred while saving the thumbnail: {e}")
+
+def get_thumbnail_state(db_name, collection_name, url):
+    try:
+        return db_manager.get_thumbnail_state(db_name, collection_name, url)
+    except Exception as e:
+        logging.error(f"An error occurred while fetching the listing: {e}")
+        return None
+
+def get_listing_by_thumbnail(db_name, collection_name, digest):
+    try:
+        return db_manager.get_listing_by_thumbnail(db_name, collection_name, digest)
     except Exception as e:
         logging.error(f"An error occurred while fetching the listing: {e}")
         return None
-    finally:
-        db_manager.close_connection()
 
 def get_regions(db_name, collection_name):
     try:
-        db_manager.connect()
         return db_manager.get_regions(db_name, collection_name)
     except Exception as e:
         logging.error(f"An error occurred while fetching regions: {e}")
         return []
-    finally:
-        db_manager.close_connection()
 
 def get_countries(db_name, collection_name):
     try:
-        db_manager.connect()
         return db_manager.get_countries(db_name, collection_name)
     except Exception as e:
         logging.error(f"An error occurred while fetching countries: {e}")
         return []
-    finally:
-        db_manager.close_connection()
 
 def get_filters(db_name, collection_name, query=None, limit=0):
     try:
-        db_manager.connect()
         return db_manager.get_filters(db_name, collection_name, query, limit)
     except Exception as e:
         logging.error(f"An error occurred while fetching regions: {e}")
         return []
-    finally:
-        db_manager.close_connection()
\ No newline at end of file
+
+def add_to_frontier(db_name, urls, region, country):
+    try:
+        db_manager.add_to_frontier(db_name, urls, region, country)
+    except Exception as e:
+        logging.error(f"An error occurred while updating the frontier: {e}")
+
+def get_frontier_urls(db_name, region, country, stale_before, urls=None):
+    try:
+        return db_manager.get_frontier_urls(db_name, region, country, stale_before, urls)
+    except Exception as e:
+        logging.error(f"An error occurred while reading the frontier: {e}")
+        return None
+
+def mark_frontier(db_name, urls, state, error=None):
+    if not urls:
+        return
+    try:
+        db_manager.mark_frontier(db_name, urls, state, error)
+    except Exception as e:
+        logging.error(f"An error occurred while updating the frontier: {e}")
+
+def get_dead_letters(db_name, limit=100):
+    try:
+        return db_manager.get_dead_letters(db_name, limit)
+    except Exception as e:
+        logging.error(f"An error occurred while reading the frontier: {e}")
+        return None
+
+def get_region_discovery(db_name, region, country):
+    try:
+        return db_manager.get_region_discovery(db_name, region, country)
+    except Exception as e:
+        logging.error(f"An error occurred while reading the frontier: {e}")
+        return None
+
+def mark_region_discovered(db_name, region, country, url_count, shards=None):
+    try:
+        db_manager.mark_region_discovered(db_name, region, country, url_count, shards)
+    except Exception as e:
+        logging.error(f"An error occurred while updating the frontier: {e}")
+
+def get_health():
+    return db_manager.health()
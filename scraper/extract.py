@@ -0,0 +1,229 @@
+import json
+import logging
+import re
+
+from lxml import html as lxml_html
+from lxml.etree import ParserError
+
+import geo
+from selector_registry import SELECTORS
+
+logger = logging.getLogger(__name__)
+
+# Checked in the browser in a single round trip before the page source is taken,
+# so the snapshot is not taken before the lazily rendered fields exist. Takes
+# one list of XPath selectors per field; a field is ready when any of its
+# selectors matches, and a field without healthy selectors is not waited for.
+FIELDS_READY_SCRIPT = """
+return arguments[0].every(function (selectors) {
+    return selectors.length === 0 || selectors.some(function (selector) {
+        return document.evaluate(selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+            .singleNodeValue !== null;
+    });
+});
+"""
+READY_FIELDS = ("title", "price", "location")
+
+# schema.org priceCurrency -> the marker prices are written with on the page,
+# so normalize.parse_price reads offer prices like scraped ones
+OFFER_CURRENCY_MARKERS = {"USD": "$", "CAD": "CA$", "MXN": "MX$", "EUR": "€", "GBP": "£"}
+# Coordinates as the listing's map data carries them in inline scripts
+_COORDINATES = re.compile(r'"(?:lat|latitude)"\s*:\s*(-?\d{1,3}\.\d+)\s*,\s*"(?:lng|lon|longitude)"\s*:\s*(-?\d{1,3}\.\d+)')
+
+
+def ready_selectors():
+    return [SELECTORS.healthy(field) for field in READY_FIELDS]
+
+
+def element_text(element):
+    # Approximates WebElement.text: whitespace is collapsed within each line and
+    # <br> elements start a new line.
+    for br in element.iter('br'):
+        br.tail = '\n' + (br.tail or '')
+    lines = (' '.join(line.split()) for line in element.text_content().split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def first_attribute(tree, xpath, attribute):
+    elements = tree.xpath(xpath)
+    return elements[0].get(attribute, "") if elements else ""
+
+
+def texts(elements):
+    return [element_text(element) for element in elements]
+
+
+def first_text(elements):
+    return element_text(elements[0]) if elements else ""
+
+
+def first_src(elements):
+    return elements[0].get("src", "") if elements else ""
+
+
+def price_text(elements):
+    return next((text.strip() for text in texts(elements) if '$' in text), "")
+
+
+def select(tree, field, pick, empty="", record=True):
+    return SELECTORS.select(field, tree.xpath, pick, empty, record)
+
+
+def extract_features(tree, record=True):
+    # The amenities modal is only in the DOM after "Show all amenities" was
+    # clicked, so its absence is not counted against its selectors here
+    features = select(tree, "amenities_modal", texts, [], record=False)
+    if features:
+        return features
+    return select(tree, "amenities_page", texts, [], record)
+
+
+def parse_html(page_source):
+    try:
+        return lxml_html.fromstring(page_source)
+    except (ParserError, ValueError) as e:
+        logger.warning(f"Could not parse page source: {e}")
+        return None
+
+
+def extract_place(page_source, url):
+    # Builds the same place dict as the per-element path from one page snapshot.
+    # Returns None when the page does not look like a listing, so the caller can
+    # fall back to querying the live page.
+    tree = parse_html(page_source)
+    if tree is None:
+        return None
+    place = place_from_tree(tree, url)
+    return place if place["title"] else None
+
+
+def place_from_tree(tree, url, record=True):
+    # record=False leaves selector health alone, for pages that are not
+    # rendered the way the selectors expect
+    return {"url": url, "title": select(tree, "title", first_text, record=record),
+            "picture_url": select(tree, "picture_url", first_src, record=record),
+            "description": select(tree, "description", first_text, record=record),
+            "price": select(tree, "price", price_text, record=record),
+            "rating": select(tree, "rating", first_text, record=record),
+            "location": select(tree, "location", first_text, record=record),
+            "features": extract_features(tree, record),
+            "house_details": select(tree, "house_details", texts, [], record),
+            **extract_coordinates(tree)}
+
+
+def extract_coordinates(tree):
+    # The listing's map position, from schema.org geo data, place meta tags or
+    # the map state in inline scripts. Missing coordinates are filled in from
+    # the location when the listing is stored.
+    candidates = []
+    for document in embedded_json(tree):
+        position = document.get("geo")
+        if isinstance(position, dict):
+            candidates.append((position.get("latitude"), position.get("longitude")))
+    candidates.append((meta_content(tree, "place:location:latitude"), meta_content(tree, "place:location:longitude")))
+    for latitude, longitude in candidates:
+        coordinates = geo.valid_coordinates(latitude, longitude)
+        if coordinates:
+            return {"latitude": coordinates[0], "longitude": coordinates[1]}
+    for script in tree.xpath("//script[not(@src)]/text()"):
+        for match in _COORDINATES.finditer(script):
+            coordinates = geo.valid_coordinates(*match.groups())
+            if coordinates:
+                return {"latitude": coordinates[0], "longitude": coordinates[1]}
+    return {"latitude": None, "longitude": None}
+
+
+def coordinates_from_source(page_source):
+    tree = parse_html(page_source)
+    return extract_coordinates(tree) if tree is not None else {"latitude": None, "longitude": None}
+
+
+def embedded_json(tree):
+    # JSON-LD blocks that describe the listing (schema.org VacationRental and
+    # friends), flattened out of any @graph wrapper.
+    documents = []
+    for script in tree.xpath("//script[@type='application/ld+json']"):
+        try:
+            data = json.loads(script.text or "")
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            data = data.get("@graph", [data])
+        if isinstance(data, list):
+            documents.extend(item for item in data if isinstance(item, dict))
+    return documents
+
+
+def meta_content(tree, prop):
+    return first_attribute(tree, f"//meta[@property='{prop}' or @name='{prop}']", "content")
+
+
+def set_missing(place, key, value):
+    if value and not place.get(key):
+        place[key] = value
+
+
+def offer_price(offer):
+    # Offers without a currency are in dollars, like the site's own prices; a
+    # currency without a known marker is kept as its code
+    currency = str(offer.get("priceCurrency") or "USD").upper()
+    marker = OFFER_CURRENCY_MARKERS.get(currency)
+    return f"{marker}{offer['price']}" if marker else f"{offer['price']} {currency}"
+
+
+def place_from_embedded(tree):
+    place = {}
+    for document in embedded_json(tree):
+        set_missing(place, "title", document.get("name"))
+        set_missing(place, "description", document.get("description"))
+
+        image = document.get("image")
+        if isinstance(image, list):
+            image = image[0] if image else ""
+        if isinstance(image, dict):
+            image = image.get("url", "")
+        set_missing(place, "picture_url", image)
+
+        rating = document.get("aggregateRating")
+        if isinstance(rating, dict) and rating.get("ratingValue"):
+            count = rating.get("ratingCount") or rating.get("reviewCount")
+            set_missing(place, "rating", f"{rating['ratingValue']} · {count} reviews" if count else
+                        str(rating["ratingValue"]))
+
+        address = document.get("address")
+        if isinstance(address, dict):
+            parts = [address.get(key) for key in ("addressLocality", "addressRegion", "addressCountry")]
+            set_missing(place, "location", ", ".join(str(part) for part in parts if part))
+
+        offers = document.get("offers")
+        if isinstance(offers, list):
+            offers = offers[0] if offers else None
+        if isinstance(offers, dict) and offers.get("price"):
+            set_missing(place, "price", offer_price(offers))
+
+    set_missing(place, "title", meta_content(tree, "og:title"))
+    set_missing(place, "picture_url", meta_content(tree, "og:image"))
+    set_missing(place, "description", meta_content(tree, "og:description"))
+    return place
+
+
+# A page fetched without a browser only counts as parsed if it has these
+REQUIRED_HTTP_FIELDS = ("title", "price")
+
+
+def extract_place_from_http(page_source, url):
+    # Server-rendered pages carry some fields in markup and others only in
+    # embedded JSON; markup wins where both are present. Most of the markup is
+    # rendered client-side, so misses here say nothing about the selectors the
+    # browser path relies on and are not recorded.
+    tree = parse_html(page_source)
+    if tree is None:
+        return None
+
+    place = place_from_tree(tree, url, record=False)
+    for key, value in place_from_embedded(tree).items():
+        set_missing(place, key, value)
+
+    if not all(place.get(field) for field in REQUIRED_HTTP_FIELDS):
+        return None
+    return place
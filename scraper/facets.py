@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from collections import Counter
+
+# How long a process serves the facet catalogue from memory before re-reading
+# it. Writes made by this process invalidate it immediately; the TTL bounds how
+# stale it gets when another process writes.
+FACET_CACHE_TTL = float(os.getenv('FACET_CACHE_TTL', 60))
+
+# Facet kind -> listing field it is taken from
+FACET_FIELDS = {"feature": "features", "region": "region", "country": "country"}
+# Facet kind -> key it is served under
+FACET_GROUPS = {"feature": "features", "region": "regions", "country": "countries"}
+
+
+def facet_values(document):
+    values = set()
+    for kind, field in FACET_FIELDS.items():
+        value = document.get(field)
+        for item in value if isinstance(value, list) else [value]:
+            if item:
+                values.add((kind, item))
+    return values
+
+
+def facet_delta(old_documents, new_documents):
+    # Count changes caused by writing new_documents over old_documents (keyed by
+    # url, missing for new listings). A write only replaces the fields it has,
+    # so a city scrape without region or country keeps the stored ones.
+    delta = Counter()
+    for document in new_documents:
+        old = old_documents.get(document["url"])
+        before = facet_values(old) if old else set()
+        after = facet_values({**old, **document} if old else document)
+        for facet in after - before:
+            delta[facet] += 1
+        for facet in before - after:
+            delta[facet] -= 1
+    return {facet: change for facet, change in delta.items() if change}
+
+
+def facet_id(kind, value):
+    return f"{kind}:{value}"
+
+
+def empty_catalogue():
+    return {group: {} for group in FACET_GROUPS.values()}
+
+
+class TTLCache:
+    def __init__(self, ttl=FACET_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.generation = 0
+
+    def get(self, key, loader):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            generation = self.generation
+        value = loader()
+        with self.lock:
+            # Don't store a value loaded before an invalidation
+            if generation == self.generation:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self.lock:
+            self.generation += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
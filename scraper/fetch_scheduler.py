@@ -0,0 +1,247 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException, WebDriverException
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Page loads per second across all browsers of this process: where the rate
+# starts and the bounds it adapts between
+FETCH_RATE = float(os.getenv('SCRAPER_FETCH_RATE', 1))
+FETCH_MIN_RATE = float(os.getenv('SCRAPER_FETCH_MIN_RATE', 0.1))
+FETCH_MAX_RATE = float(os.getenv('SCRAPER_FETCH_MAX_RATE', 5))
+FETCH_BURST = int(os.getenv('SCRAPER_FETCH_BURST', 3))
+# Added to the rate after every successful page load
+FETCH_RATE_STEP = float(os.getenv('SCRAPER_FETCH_RATE_STEP', 0.05))
+# Page loads in flight at once; grows by one after a full window of successes
+FETCH_MAX_CONCURRENCY = int(os.getenv('SCRAPER_FETCH_MAX_CONCURRENCY', 8))
+# Attempts per page load after the first, spaced by exponential backoff with
+# full jitter: a random delay of up to BACKOFF_BASE * 2^attempt seconds
+FETCH_RETRIES = int(os.getenv('SCRAPER_FETCH_RETRIES', 3))
+BACKOFF_BASE = float(os.getenv('SCRAPER_BACKOFF_BASE', 2))
+BACKOFF_MAX = float(os.getenv('SCRAPER_BACKOFF_MAX', 120))
+
+# Checked in the browser after every load. Returns why the page looks like a
+# block or challenge page instead of content, or null.
+BLOCK_CHECK_SCRIPT = """
+var title = (document.title || '').toLowerCase();
+var url = location.href.toLowerCase();
+var text = document.body ? document.body.innerText.slice(0, 2000).toLowerCase() : '';
+if (document.querySelector('#px-captcha, iframe[src*="captcha"], iframe[src*="recaptcha"], div.g-recaptcha')) {
+    return 'captcha';
+}
+if (url.indexOf('/challenge') !== -1 || url.indexOf('captcha') !== -1) {
+    return 'challenge page';
+}
+var signals = ['access denied', 'pardon our interruption', 'too many requests', 'unusual traffic',
+               'verify you are a human', 'are you a robot'];
+for (var i = 0; i < signals.length; i++) {
+    if (title.indexOf(signals[i]) !== -1 || text.indexOf(signals[i]) !== -1) {
+        return signals[i];
+    }
+}
+return null;
+"""
+
+# WebDriver errors that mean the page failed to load, not that the session is
+# gone; anything else is raised so the pool replaces the browser
+RETRYABLE_ERRORS = ("net::ERR_",)
+
+FETCHES = metrics.REGISTRY.counter(
+    "scraper_fetches_total", "Page loads by outcome.", ["outcome"])
+FETCH_RATE_GAUGE = metrics.REGISTRY.gauge(
+    "scraper_fetch_rate", "Current page load rate limit per second.")
+FETCH_CONCURRENCY_GAUGE = metrics.REGISTRY.gauge(
+    "scraper_fetch_concurrency", "Current limit on page loads in flight.")
+
+
+class Blocked(Exception):
+    pass
+
+
+def retryable(error):
+    if isinstance(error, InvalidSessionIdException):
+        return False
+    message = error.msg or ""
+    return any(marker in message for marker in RETRYABLE_ERRORS)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.refill(time.monotonic())
+            self.rate = rate
+
+
+class AdaptiveLimit:
+    # A semaphore whose size can change while it is held
+    def __init__(self, limit, maximum):
+        self.limit = limit
+        self.maximum = maximum
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def set(self, limit):
+        with self.condition:
+            self.limit = max(1, min(self.maximum, limit))
+            self.condition.notify_all()
+
+
+class FetchScheduler:
+    # Paces page loads for every browser in the process. The rate and the
+    # number of loads in flight grow additively while pages load cleanly and
+    # are halved when the site answers with a block or challenge page, which
+    # also pauses all loads for a backoff period (AIMD).
+    def __init__(self, rate=FETCH_RATE, burst=FETCH_BURST, max_concurrency=FETCH_MAX_CONCURRENCY,
+                 retries=FETCH_RETRIES, min_rate=FETCH_MIN_RATE, max_rate=FETCH_MAX_RATE):
+        self.bucket = TokenBucket(rate, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = AdaptiveLimit(max_concurrency, max_concurrency)
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.successes = 0
+        self.blocks = 0
+        self.paused_until = 0.0
+        self.publish()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def wait_if_paused(self):
+        while True:
+            remaining = self.paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def fetch(self, browser, navigate, label, retries=None):
+        # Runs navigate() (a browser.get or a click that loads a page) once the
+        # rate and concurrency limits allow it, retrying timeouts, network errors
+        # and blocked pages. Raises the last error once the retries are used up.
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            self.wait_if_paused()
+            self.concurrency.acquire()
+            try:
+                self.bucket.acquire()
+                navigate()
+                reason = browser.execute_script(BLOCK_CHECK_SCRIPT)
+                if reason:
+                    raise Blocked(f"{label}: {reason}")
+            except Blocked as e:
+                error = e
+                self.on_blocked(e, attempt)
+            except TimeoutException as e:
+                error = e
+                self.on_timeout(label)
+            except WebDriverException as e:
+                if not retryable(e):
+                    raise
+                error = e
+                self.on_network_error(label, e)
+            else:
+                self.on_success()
+                return
+            finally:
+                self.concurrency.release()
+            if attempt < retries:
+                delay = self.backoff(attempt)
+                FETCHES.inc(outcome="retry")
+                logger.info(f"Retrying {label} in {delay:.1f}s (attempt {attempt + 2} of {retries + 1})")
+                time.sleep(delay)
+        raise error
+
+    def load(self, browser, url, retries=None):
+        self.fetch(browser, lambda: browser.get(url), url, retries)
+
+    def on_success(self):
+        FETCHES.inc(outcome="ok")
+        with self.lock:
+            self.successes += 1
+            self.bucket.set_rate(min(self.max_rate, self.bucket.rate + FETCH_RATE_STEP))
+            if self.successes >= self.concurrency.limit:
+                self.successes = 0
+                self.concurrency.set(self.concurrency.limit + 1)
+            self.publish()
+
+    def on_blocked(self, error, attempt):
+        FETCHES.inc(outcome="blocked")
+        with self.lock:
+            self.blocks += 1
+            self.successes = 0
+            self.bucket.set_rate(max(self.min_rate, self.bucket.rate / 2))
+            self.concurrency.set(self.concurrency.limit // 2)
+            pause = self.backoff(attempt + 1)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.publish()
+        logger.warning(f"Blocked ({error}); pausing page loads for {pause:.1f}s, rate now "
+                       f"{self.bucket.rate:.2f}/s with {self.concurrency.limit} in flight")
+
+    def on_timeout(self, label):
+        # A slow site is treated as congested: fewer loads in flight, same rate
+        FETCHES.inc(outcome="timeout")
+        with self.lock:
+            self.successes = 0
+            self.concurrency.set(self.concurrency.limit - 1)
+            self.publish()
+        logger.warning(f"Timed out loading {label}")
+
+    def on_network_error(self, label, error):
+        # Connection resets and the like count as congestion too
+        FETCHES.inc(outcome="network_error")
+        with self.lock:
+            self.successes = 0
+            self.concurrency.set(self.concurrency.limit - 1)
+            self.publish()
+        message = (error.msg or str(error)).splitlines()[0]
+        logger.warning(f"Network error loading {label}: {message}")
+
+    def publish(self):
+        FETCH_RATE_GAUGE.set(self.bucket.rate)
+        FETCH_CONCURRENCY_GAUGE.set(self.concurrency.limit)
+
+    def stats(self):
+        return {"rate": round(self.bucket.rate, 3), "concurrency": self.concurrency.limit,
+                "blocks": self.blocks}
+
+
+scheduler = FetchScheduler()
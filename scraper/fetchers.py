@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+import extract
+import metrics
+from pool import TaskFailed
+
+logger = logging.getLogger(__name__)
+
+HTTP_CONCURRENCY = int(os.getenv('SCRAPER_HTTP_CONCURRENCY', 16))
+HTTP_TIMEOUT = float(os.getenv('SCRAPER_HTTP_TIMEOUT', 20))
+HTTP_HEADERS = {
+    "User-Agent": os.getenv(
+        'SCRAPER_USER_AGENT',
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/130.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+class ListingFetcher:
+    # Turns listing URLs into place dicts. fetch_many yields (url, place) pairs in
+    # completion order, with a TaskFailed in place of the dict for URLs that could
+    # not be scraped.
+    name = None
+
+    def fetch_many(self, urls):
+        raise NotImplementedError
+
+
+class SeleniumFetcher(ListingFetcher):
+    name = 'selenium'
+
+    def __init__(self, pool, scrape_func):
+        self.pool = pool
+        self.scrape_func = scrape_func
+
+    def fetch_many(self, urls):
+        return self.pool.imap_unordered(self.scrape_func, urls)
+
+
+class HttpFetcher(ListingFetcher):
+    # Fetches listing pages over plain HTTP and parses the server-rendered markup.
+    # Pages that do not parse are handed to the fallback fetcher.
+    name = 'http'
+
+    def __init__(self, fallback=None, concurrency=HTTP_CONCURRENCY, timeout=HTTP_TIMEOUT, headers=None):
+        self.fallback = fallback
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers = headers or HTTP_HEADERS
+
+    async def fetch_one(self, session, semaphore, url):
+        async with semaphore:
+            try:
+                with metrics.STAGE_SECONDS.time(stage="http_fetch"):
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        page_source = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError) as e:
+                return url, None, e
+        # One odd page fails on its own instead of taking the rest of the chunk with it
+        try:
+            with metrics.STAGE_SECONDS.time(stage="http_extract"):
+                place = extract.extract_place_from_http(page_source, url)
+        except Exception as e:
+            logger.warning(f"Could not extract {url}: {e}")
+            return url, None, e
+        if place is None:
+            return url, None, ValueError("page did not contain the required listing fields")
+        return url, place, None
+
+    async def fetch_all(self, urls):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+            return await asyncio.gather(*(self.fetch_one(session, semaphore, url) for url in urls))
+
+    def fetch_many(self, urls):
+        # URLs are fetched in chunks so only a bounded number of pages is held
+        # in memory while the caller consumes the results.
+        urls = list(urls)
+        chunk_size = self.concurrency * 4
+        failed = []
+        for offset in range(0, len(urls), chunk_size):
+            for url, place, error in asyncio.run(self.fetch_all(urls[offset:offset + chunk_size])):
+                if place is not None:
+                    yield url, place
+                else:
+                    logger.info(f"HTTP fetch of {url} failed: {error}")
+                    failed.append((url, error))
+
+        if urls:
+            logger.info(f"Fetched {len(urls) - len(failed)} of {len(urls)} listings over HTTP")
+        if failed and self.fallback:
+            yield from self.fallback.fetch_many([url for url, _ in failed])
+        else:
+            for url, error in failed:
+                yield url, TaskFailed(url, error)
+
+
+FETCHER_NAMES = (SeleniumFetcher.name, HttpFetcher.name)
+
+
+def create_fetcher(name, pool, scrape_func):
+    selenium_fetcher = SeleniumFetcher(pool, scrape_func)
+    if name == HttpFetcher.name:
+        return HttpFetcher(fallback=selenium_fetcher)
+    if name == SeleniumFetcher.name:
+        return selenium_fetcher
+    raise ValueError(f"Unknown fetcher: {name}")
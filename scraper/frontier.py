@@ -0,0 +1,51 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Listings scraped more recently than this are skipped on re-runs, and regions
+# discovered more recently than this are not paged through again.
+FRESHNESS_WINDOW = timedelta(hours=float(os.getenv('SCRAPER_FRESHNESS_HOURS', 24 * 7)))
+
+
+class CrawlFrontier:
+    # Per-URL crawl state (pending/done/failed and when it was last scraped),
+    # persisted in MongoDB so an interrupted crawl resumes where it stopped.
+    def __init__(self, db_name, freshness=FRESHNESS_WINDOW):
+        self.db_name = db_name
+        self.freshness = freshness
+
+    def stale_before(self):
+        return datetime.now(timezone.utc) - self.freshness
+
+    def region_is_fresh(self, region, country):
+        discovery = db.get_region_discovery(self.db_name, region, country)
+        if not discovery:
+            return False
+        discovered_at = discovery["discovered_at"]
+        if discovered_at.tzinfo is None:
+            discovered_at = discovered_at.replace(tzinfo=timezone.utc)
+        return discovered_at >= self.stale_before()
+
+    def add_region_urls(self, region, country, urls, shards=None):
+        # shards: what each discovery query of the region found, for reporting
+        db.add_to_frontier(self.db_name, urls, region, country)
+        db.mark_region_discovered(self.db_name, region, country, len(urls), shards)
+
+    def urls_to_scrape(self, region, country, discovered_urls=None):
+        # New, failed and stale URLs among those just discovered, or of all the
+        # region owns when resuming. If the frontier can't be read, everything
+        # that was just discovered is scraped.
+        urls = db.get_frontier_urls(self.db_name, region, country, self.stale_before(), discovered_urls)
+        if urls is None:
+            return list(discovered_urls or [])
+        skipped = len(discovered_urls) - len(urls) if discovered_urls is not None else None
+        if skipped:
+            logger.info(f"Skipping {skipped} recently scraped listings for {region}, {country}")
+        return urls
+
+    def mark_failed(self, url, error):
+        db.mark_frontier(self.db_name, [url], "failed", str(error))
@@ -0,0 +1,155 @@
+import csv
+import logging
+import os
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Centroids of states, provinces and the cities the crawl shards by, used for
+# listings whose page did not expose coordinates. Rows with an empty region
+# are regions themselves.
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'data', 'gazetteer.csv'))
+
+# Radius of a near= search when radius_km is not given, and the largest allowed
+GEO_DEFAULT_RADIUS_KM = float(os.getenv('GEO_DEFAULT_RADIUS_KM', 25))
+GEO_MAX_RADIUS_KM = float(os.getenv('GEO_MAX_RADIUS_KM', 500))
+EARTH_RADIUS_KM = 6378.1
+BOX_SPAN_DEGREES = 90.0
+
+COUNTRY_NAMES = {"usa": "USA", "us": "USA", "united states": "USA", "united states of america": "USA",
+                 "canada": "Canada"}
+
+
+def normalize_name(value):
+    return " ".join((value or "").lower().replace(".", "").split())
+
+
+def normalize_country(value):
+    name = normalize_name(value)
+    return COUNTRY_NAMES.get(name, value or None)
+
+
+@lru_cache(maxsize=None)
+def load_gazetteer(path=GAZETTEER_PATH):
+    # name -> [(region, country, latitude, longitude)] for cities and regions
+    cities, regions = {}, {}
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                entry = (row["region"] or None, row["country"], float(row["latitude"]), float(row["longitude"]))
+                places = cities if row["region"] else regions
+                places.setdefault(normalize_name(row["name"]), []).append(entry)
+    except OSError as e:
+        logger.warning(f"Gazetteer {path} is not available, listings without coordinates stay unplaced: {e}")
+    return cities, regions
+
+
+def matching(entries, country, region=None):
+    for entry_region, entry_country, latitude, longitude in entries or []:
+        if country and entry_country != country:
+            continue
+        if region and normalize_name(entry_region) != normalize_name(region):
+            continue
+        return latitude, longitude
+    return None
+
+
+@lru_cache(maxsize=4096)
+def lookup(location, region=None, country=None):
+    # "Toronto, Ontario, Canada" -> (latitude, longitude, precision) from the
+    # gazetteer: the city if it is listed, else the state or province.
+    cities, regions = load_gazetteer()
+    parts = [part.strip() for part in (location or "").split(",") if part.strip()]
+    if parts and normalize_country(parts[-1]) in COUNTRY_NAMES.values():
+        country = country or normalize_country(parts[-1])
+        parts = parts[:-1]
+    country = normalize_country(country)
+
+    # The first part is the locality; the region comes after it
+    if len(parts) > 1:
+        found = matching(cities.get(normalize_name(parts[0])), country, parts[1])
+        if found:
+            return (*found, "city")
+    for part in list(reversed(parts[1:])) + parts[:1] + ([region] if region else []):
+        found = matching(regions.get(normalize_name(part)), country)
+        if found:
+            return (*found, "region")
+    return None
+
+
+def valid_coordinates(latitude, longitude):
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if -90 <= latitude <= 90 and -180 <= longitude <= 180 and (latitude, longitude) != (0, 0):
+        return latitude, longitude
+    return None
+
+
+def point(latitude, longitude):
+    # GeoJSON puts longitude first
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def geo_fields(document):
+    # Coordinates scraped from the listing page when there are any, otherwise
+    # the gazetteer centroid of its location
+    coordinates = valid_coordinates(document.get("latitude"), document.get("longitude"))
+    if coordinates:
+        return {"geo": point(*coordinates), "geo_precision": "exact"}
+    found = lookup(document.get("location") or "", document.get("region"), document.get("country"))
+    if found:
+        latitude, longitude, precision = found
+        return {"geo": point(latitude, longitude), "geo_precision": precision}
+    return {"geo": None, "geo_precision": None}
+
+
+def parse_floats(value, count, name):
+    parts = value.split(",")
+    if len(parts) != count:
+        raise ValueError(f"{name} takes {count} comma-separated numbers")
+    try:
+        return [float(part) for part in parts]
+    except ValueError:
+        raise ValueError(f"{name} takes {count} comma-separated numbers")
+
+
+def box_spans(west, east):
+    # Longitude spans of a map box, split at the antimeridian and into pieces
+    # no wider than BOX_SPAN_DEGREES, since a polygon may not cover a hemisphere
+    spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+    pieces = []
+    for left, right in spans:
+        while right - left > BOX_SPAN_DEGREES:
+            pieces.append((left, left + BOX_SPAN_DEGREES))
+            left += BOX_SPAN_DEGREES
+        pieces.append((left, right))
+    return pieces
+
+
+def geo_query(args):
+    # near=lat,lng with radius_km, or bbox=west,south,east,north. Raises
+    # ValueError for malformed values.
+    query = {}
+    if args.get("near"):
+        latitude, longitude = parse_floats(args["near"], 2, "near")
+        if not valid_coordinates(latitude, longitude):
+            raise ValueError("near is not a valid latitude and longitude")
+        try:
+            radius = float(args.get("radius_km") or GEO_DEFAULT_RADIUS_KM)
+        except ValueError:
+            raise ValueError("radius_km must be a number")
+        if not 0 < radius <= GEO_MAX_RADIUS_KM:
+            raise ValueError(f"radius_km must be between 0 and {GEO_MAX_RADIUS_KM:g}")
+        query["$geoWithin"] = {"$centerSphere": [[longitude, latitude], radius / EARTH_RADIUS_KM]}
+    elif args.get("bbox"):
+        west, south, east, north = parse_floats(args["bbox"], 4, "bbox")
+        if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south < north <= 90):
+            raise ValueError("bbox must be west,south,east,north in degrees")
+        query["$geoWithin"] = {"$geometry": {"type": "MultiPolygon", "coordinates": [
+            [[[left, south], [right, south], [right, north], [left, north], [left, south]]]
+            for left, right in box_spans(west, east)
+        ]}}
+    return {"geo": query} if query else {}
@@ -0,0 +1,312 @@
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Scrape jobs run on their own threads, never on the web server's, so reads
+# stay responsive while a crawl is running. Jobs beyond this many wait queued.
+SCRAPE_JOB_WORKERS = int(os.getenv('SCRAPE_JOB_WORKERS', 1))
+# Minimum seconds between progress writes to MongoDB for a running job
+PROGRESS_WRITE_INTERVAL = float(os.getenv('SCRAPE_JOB_PROGRESS_INTERVAL', 5))
+# A running job's owner refreshes its heartbeat this often; a running job whose
+# heartbeat is older than SCRAPE_JOB_STALE_SECONDS lost its process and is
+# taken over by whichever process notices first
+HEARTBEAT_INTERVAL = float(os.getenv('SCRAPE_JOB_HEARTBEAT_INTERVAL', 15))
+STALE_SECONDS = float(os.getenv('SCRAPE_JOB_STALE_SECONDS', 120))
+
+JOBS_COLLECTION = "scrape_jobs"
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = "queued", "running", "completed", "failed", "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Progress:
+    # Progress hooks called by the scrape loop; this base class ignores them so
+    # the scrape functions can run outside of a job too.
+    def set_regions(self, total):
+        pass
+
+    def urls_discovered(self, count):
+        pass
+
+    def listing_scraped(self):
+        pass
+
+    def listing_failed(self):
+        pass
+
+    def region_done(self):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+
+class JobProgress(Progress):
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.written_at = 0.0
+        self.counts = {"regions_total": 0, "regions_done": 0, "urls_discovered": 0,
+                       "urls_scraped": 0, "urls_failed": 0}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+        self.save()
+
+    def set_regions(self, total):
+        with self.lock:
+            self.counts["regions_total"] = total
+        self.save(force=True)
+
+    def urls_discovered(self, count):
+        self.increment("urls_discovered", count)
+
+    def listing_scraped(self):
+        self.increment("urls_scraped")
+
+    def listing_failed(self):
+        self.increment("urls_failed")
+
+    def region_done(self):
+        self.increment("regions_done")
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def eta_seconds(self):
+        # Extrapolated from the share of work finished so far: regions for
+        # multi-region jobs, listings otherwise
+        counts = self.counts
+        elapsed = time.monotonic() - self.started
+        if counts["regions_total"] > 1 and counts["regions_done"]:
+            done, total = counts["regions_done"], counts["regions_total"]
+        else:
+            done = counts["urls_scraped"] + counts["urls_failed"]
+            total = counts["urls_discovered"]
+        if not done or total <= done:
+            return None
+        return round(elapsed / done * (total - done))
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.counts, "eta_seconds": self.eta_seconds()}
+
+    def save(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.written_at < PROGRESS_WRITE_INTERVAL:
+            return
+        self.written_at = now
+        self.manager.update(self.job_id, {"progress": self.snapshot()})
+
+
+class JobManager:
+    # Runs scrape jobs in the background and persists their state in MongoDB.
+    # runners maps a job kind to runner(params, progress), which returns a
+    # (summary, response) pair: the summary is persisted as the job's result,
+    # the response is handed to a caller waiting on the job in this process.
+    def __init__(self, db_name, runners, workers=SCRAPE_JOB_WORKERS):
+        self.db_name = db_name
+        self.runners = runners
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.active = {}
+        self.results = {}
+        self.keep_results = set()
+        self.done_events = {}
+        self.lock = threading.Lock()
+        self.threads = []
+        # Identifies this process on the jobs it runs
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def collection(self):
+        return db.db_manager.get_collection(self.db_name, JOBS_COLLECTION)
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f"scrape-job-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self.beat, name="scrape-job-heartbeat", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        self.recover()
+        return self
+
+    def recover(self):
+        # Queued jobs are picked up, whoever queued them; claiming is atomic, so
+        # a job queued in several processes still runs once
+        try:
+            queued = list(self.collection().find({"status": QUEUED}, {"_id": 1}).sort("created_at", 1))
+        except Exception as e:
+            logger.error(f"Could not recover scrape jobs: {e}")
+            return
+        for job in queued:
+            self.enqueue(job["_id"])
+        self.recover_orphans()
+
+    def recover_orphans(self):
+        # Running jobs whose owner stopped sending heartbeats are run again; the
+        # crawl frontier lets them skip what was already scraped
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=STALE_SECONDS)
+        stale = {"status": RUNNING, "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": None}]}
+        try:
+            orphans = list(self.collection().find(stale, {"_id": 1, "kind": 1, "owner": 1}).sort("created_at", 1))
+            for job in orphans:
+                # Requeued only if no other process took it over in the meantime
+                if self.collection().find_one_and_update({"_id": job["_id"], **stale},
+                                                         {"$set": {"status": QUEUED, "owner": None}}):
+                    logger.info(f"Resuming scrape job {job['_id']} ({job['kind']}) "
+                                f"abandoned by {job.get('owner') or 'an unknown process'}")
+                    self.enqueue(job["_id"])
+        except Exception as e:
+            logger.error(f"Could not recover orphaned scrape jobs: {e}")
+
+    def beat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            job_ids = list(self.active)
+            if job_ids:
+                try:
+                    self.collection().update_many({"_id": {"$in": job_ids}, "owner": self.owner},
+                                                  {"$set": {"heartbeat_at": datetime.now(timezone.utc)}})
+                except Exception as e:
+                    logger.error(f"Could not refresh scrape job heartbeats: {e}")
+            self.recover_orphans()
+
+    def submit(self, kind, params, keep_result=False):
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        self.collection().insert_one({
+            "_id": job_id,
+            "kind": kind,
+            "params": params,
+            "status": QUEUED,
+            "created_at": datetime.now(timezone.utc),
+            "started_at": None,
+            "finished_at": None,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "owner": None,
+            "heartbeat_at": None,
+        })
+        if keep_result:
+            with self.lock:
+                self.keep_results.add(job_id)
+        self.enqueue(job_id)
+        logger.info(f"Queued scrape job {job_id} ({kind})")
+        return job_id
+
+    def enqueue(self, job_id):
+        with self.lock:
+            self.done_events.setdefault(job_id, threading.Event())
+        self.queue.put(job_id)
+
+    def update(self, job_id, fields):
+        try:
+            self.collection().update_one({"_id": job_id}, {"$set": fields})
+        except Exception as e:
+            logger.error(f"Could not update scrape job {job_id}: {e}")
+
+    def get(self, job_id):
+        job = self.collection().find_one({"_id": job_id})
+        if job is None:
+            return None
+        progress = self.active.get(job_id)
+        if progress:
+            # Fresher than the throttled copy in MongoDB
+            job["progress"] = progress.snapshot()
+        return job
+
+    def list(self, limit=20):
+        return list(self.collection().find({}, {"result": 0}).sort("created_at", -1).limit(limit))
+
+    def cancel(self, job_id):
+        progress = self.active.get(job_id)
+        if progress:
+            progress.cancel_event.set()
+            return True
+        result = self.collection().update_one({"_id": job_id, "status": QUEUED},
+                                              {"$set": {"status": CANCELLED,
+                                                        "finished_at": datetime.now(timezone.utc)}})
+        return result.modified_count == 1
+
+    def wait(self, job_id, timeout=None):
+        # Outcome of a job submitted with keep_result=True by this process:
+        # {"status", "response", "error"}, or None if it did not finish in time
+        with self.lock:
+            event = self.done_events.get(job_id)
+        finished = event is None or event.wait(timeout)
+        # Collected once either way, so a result that arrives after a timeout is not kept forever
+        with self.lock:
+            self.keep_results.discard(job_id)
+            outcome = self.results.pop(job_id, None)
+        return outcome if finished else None
+
+    def work(self):
+        while True:
+            job_id = self.queue.get()
+            try:
+                self.run(job_id)
+            except Exception as e:
+                logger.error(f"Scrape job {job_id} crashed: {e}")
+            finally:
+                with self.lock:
+                    event = self.done_events.pop(job_id, None)
+                if event:
+                    event.set()
+
+    def run(self, job_id):
+        # Claimed atomically, so a job enqueued by several processes runs once
+        now = datetime.now(timezone.utc)
+        job = self.collection().find_one_and_update(
+            {"_id": job_id, "status": QUEUED},
+            {"$set": {"status": RUNNING, "started_at": now, "owner": self.owner, "heartbeat_at": now}})
+        if job is None:
+            return
+
+        progress = JobProgress(self, job_id)
+        self.active[job_id] = progress
+        logger.info(f"Running scrape job {job_id} ({job['kind']})")
+        summary = response = error = None
+        try:
+            summary, response = self.runners[job["kind"]](job["params"], progress)
+            status = COMPLETED
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            logger.error(f"Scrape job {job_id} failed: {e}")
+            status, error = FAILED, str(e)
+        finally:
+            self.active.pop(job_id, None)
+
+        with self.lock:
+            if job_id in self.keep_results:
+                self.results[job_id] = {"status": status, "response": response, "error": error}
+        self.update(job_id, {
+            "status": status,
+            "error": error,
+            "result": summary,
+            "progress": progress.snapshot(),
+            "finished_at": datetime.now(timezone.utc),
+        })
+        logger.info(f"Scrape job {job_id} {status}")
@@ -1,20 +1,37 @@
 # app.py
-import time
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException
 import db
 import logging
-from flask import Flask, request, jsonify
-from bson.json_util import dumps
-import json
+from flask import Flask, request, jsonify, Response, stream_with_context, g, redirect, url_for, send_file
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import re
 import os
 from waitress import serve
 from config import config
+from collections import namedtuple, deque
+import queue
+from pool import BrowserPool, TaskFailed, POOL_SIZE, MAX_POOL_SIZE
+from readiness import PageDeadline, document_ready
+import extract
+from fetchers import create_fetcher, FETCHER_NAMES
+from frontier import CrawlFrontier
+from writer import ListingWriter
+import normalize
+import geo
+import thumbnails
+import threading
+from cache import create_response_cache
+from jobs import JobManager, Progress
+import metrics
+import time
+from selector_registry import SELECTORS
+from browser import create_browser
+from sharding import region_shards, shard_label, listing_id, ShardResults
+from fetch_scheduler import scheduler, Blocked
 
 # Configure logging
 log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
@@ -49,8 +66,17 @@ US_STATES = [
     "Utah", "Vermont", "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming"
 ]
 
+class MongoJSONProvider(DefaultJSONProvider):
+    # jsonify serializes ObjectId and datetime values itself, so documents from
+    # pymongo are encoded once instead of going through BSON extended JSON first
+    default = staticmethod(db.JSONEncoder().default)
+
+
+json_encoder = db.JSONEncoder(separators=(',', ':'))
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = MongoJSONProvider(app)
 allowed_origin = os.getenv('CORS_ORIGIN', 'http://localhost:6969')
 CORS(app, resources={r"/*": {"origins": allowed_origin}})
 
@@ -58,245 +84,593 @@ CORS(app, resources={r"/*": {"origins": allowed_origin}})
 DB_NAME = "airbnb"
 COLLECTION_NAME = "listings"
 
+# Read endpoints are cached until the next listing write
+response_cache = create_response_cache(DB_NAME)
+
+# How long to look for an optional popup before assuming there is none
+MODAL_TIMEOUT = float(os.getenv('SCRAPER_MODAL_TIMEOUT', 1))
+# How long to wait for "Show all amenities"; listings with only a few amenities
+# have no such button
+AMENITIES_BUTTON_TIMEOUT = float(os.getenv('SCRAPER_AMENITIES_BUTTON_TIMEOUT', 3))
+# 'source' parses one page_source snapshot per listing, 'elements' queries the
+# live page field by field
+EXTRACT_MODE = os.getenv('SCRAPER_EXTRACT_MODE', 'source')
+# 'selenium' renders every listing in Chrome, 'http' fetches listing pages
+# without a browser and only falls back to Chrome for pages that do not parse
+FETCHER = os.getenv('SCRAPER_FETCHER', 'selenium')
+
+# Where search pages are loaded from; benchmarks point it at recorded fixtures
+AIRBNB_BASE_URL = os.getenv('AIRBNB_BASE_URL', 'https://www.airbnb.com').rstrip('/')
+
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Longest a scrape endpoint holds the request open waiting for its job; after
+# that it answers 202 with the job's status URL and the job keeps running
+SCRAPE_WAIT_TIMEOUT = float(os.getenv('SCRAPE_WAIT_TIMEOUT', 300))
+
 
 # Your existing helper functions
 def initialize_browser():
-    browser = webdriver.Chrome()
-    return browser
-
+    # Headless and without images, fonts, media or trackers unless
+    # SCRAPER_BROWSER_PROFILE=default; the pool restarts it every
+    # SCRAPER_MAX_PAGES_PER_BROWSER pages
+    return create_browser()
 
-def wait_for_elements(browser, by, value, timeout=10):
-    return WebDriverWait(browser, timeout).until(
-        EC.presence_of_all_elements_located((by, value))
-    )
 
-def get_text_or_empty(browser, by, value):
-    try:
-        element = WebDriverWait(browser, 10).until(
-            EC.presence_of_element_located((by, value))
-        )
-        return element.text
-    except (TimeoutException, NoSuchElementException):
-        return ""
+def select_elements(browser, field, pick, empty="", deadline=None, record=True):
+    # Waits until any healthy selector of the field matches, then takes the value
+    # from the first selector that yields one. Fields whose selectors are all
+    # broken are not waited for.
+    healthy = SELECTORS.healthy(field)
+    if deadline and healthy:
+        deadline.until_or_none(browser, EC.presence_of_element_located((By.XPATH, " | ".join(healthy))), field)
+    return SELECTORS.select(field, lambda selector: browser.find_elements(By.XPATH, selector), pick, empty, record)
 
-def get_price(browser, by, value):
-    try:
-        elements = WebDriverWait(browser, 10).until(
-            EC.presence_of_all_elements_located((by, value))
-        )
+def element_texts(elements):
+    return [element.text for element in elements]
 
-        for element in elements:
-            if '$' in element.text:
-                return element.text.strip()
+def first_element_text(elements):
+    return elements[0].text if elements else ""
 
-        return ""  # Return empty string if no element with '$' is found
-    except (TimeoutException, NoSuchElementException):
-        logging.error(f"Error finding price elements: {by}, {value}")
-        return ""
+def first_element_src(elements):
+    return (elements[0].get_attribute('src') or "") if elements else ""
 
-def get_attribute_or_empty(browser, by, value, attribute):
-    try:
-        element = WebDriverWait(browser, 10).until(
-            EC.presence_of_element_located((by, value))
-        )
-        return element.get_attribute(attribute)
-    except (TimeoutException, NoSuchElementException):
-        return ""
+def element_price(elements):
+    # The first price-like element with a dollar amount
+    return next((element.text.strip() for element in elements if '$' in element.text), "")
 
-def get_place_urls(browser, location):
+@metrics.STAGE_SECONDS.time(stage="place_urls")
+def get_place_urls(browser, location, price_min=None, price_max=None):
     urls = set()
-    base_url = f'https://www.airbnb.com/s/{location}/homes?tab_id=home_tab&refinement_paths%5B%5D=%2Fhomes&flexible_trip_lengths%5B%5D=one_week&monthly_start_date=2024-12-01&monthly_length=12&monthly_end_date=2026-12-01&price_filter_input_type=0&channel=EXPLORE&date_picker_type=flexible_dates&source=structured_search_input_header&adults=3&search_type=autocomplete_click&query={location}'
-    browser.get(base_url)
+    price_filter = ''
+    if price_min is not None:
+        price_filter += f'&price_min={price_min}'
+    if price_max is not None:
+        price_filter += f'&price_max={price_max}'
+    base_url = f'{AIRBNB_BASE_URL}/s/{location}/homes?tab_id=home_tab&refinement_paths%5B%5D=%2Fhomes&flexible_trip_lengths%5B%5D=one_week&monthly_start_date=2024-12-01&monthly_length=12&monthly_end_date=2026-12-01&price_filter_input_type=0&channel=EXPLORE&date_picker_type=flexible_dates&source=structured_search_input_header&adults=3&search_type=autocomplete_click&query={location}{price_filter}'
+    scheduler.load(browser, base_url)
+    page = 1
 
     while True:
-        places_to_stay = wait_for_elements(browser, By.CLASS_NAME, "atm_7l_1j28jx2")
-        for place in places_to_stay:
-            url = place.get_attribute('href')
-            if url:
-                urls.add(url)
+        deadline = PageDeadline(label=f"{location} results page {page}")
+        with metrics.STAGE_SECONDS.time(stage="search_page"):
+            places_to_stay = select_elements(browser, "result_link", list, [], deadline)
+            for place in places_to_stay:
+                url = place.get_attribute('href')
+                if url:
+                    urls.add(url)
 
         logging.info(f"Found {len(urls)} unique places so far")
+        if not places_to_stay:
+            logging.warning(f"No results found on page {page} for {location}")
+            deadline.log_summary()
+            break
 
         try:
-            next_button = WebDriverWait(browser, 10).until(
-                EC.element_to_be_clickable((By.XPATH, "//a[@aria-label='Next']"))
+            next_button = deadline.until(
+                browser, EC.element_to_be_clickable((By.XPATH, "//a[@aria-label='Next']")), "next button"
             )
-            next_button.click()
-            time.sleep(5)
+            # Paced like a page load, but not retried: clicking again would skip a page
+            scheduler.fetch(browser, next_button.click, f"{location} results page {page + 1}", retries=0)
+            # The old result cards are detached once the next page renders
+            deadline.until(browser, EC.staleness_of(places_to_stay[0]), "next page")
+            page += 1
         except (TimeoutException, NoSuchElementException):
             logging.info("Reached the last page or no more results")
             break
+        except Blocked as e:
+            logging.warning(f"Stopped paging {location}: {e}")
+            break
+        finally:
+            deadline.log_summary()
 
     return list(urls)
 
-def close_modal(browser):
+def close_modal(browser, deadline=None):
+    deadline = deadline or PageDeadline(MODAL_TIMEOUT, label="close modal")
     try:
-        close_button = WebDriverWait(browser, 5).until(
-            EC.element_to_be_clickable((By.XPATH, "//button[@aria-label='Close']"))
+        close_button = deadline.until(
+            browser, EC.element_to_be_clickable((By.XPATH, "//button[@aria-label='Close']")), "close button",
+            cap=MODAL_TIMEOUT
         )
         close_button.click()
-        time.sleep(1)
+        deadline.until_or_none(browser, EC.staleness_of(close_button), "modal closed", cap=MODAL_TIMEOUT)
         logging.info("Successfully closed modal")
     except (TimeoutException, NoSuchElementException):
         logging.info("No modal found to close")
 
-def click_show_all_amenities(browser):
+def click_show_all_amenities(browser, deadline=None):
+    deadline = deadline or PageDeadline(label="amenities")
     try:
         # Close any open modals first
-        close_modal(browser)
+        close_modal(browser, deadline)
 
         # Wait for the button to be clickable
-        button = WebDriverWait(browser, 10).until(
-            EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Show all') and contains(., 'amenities')]"))
+        button = deadline.until(
+            browser,
+            EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Show all') and contains(., 'amenities')]")),
+            "show all amenities",
+            cap=AMENITIES_BUTTON_TIMEOUT
         )
-        # Scroll the button into view
-        browser.execute_script("arguments[0].scrollIntoView(true);", button)
-        # Wait a bit for any animations to finish
-        time.sleep(1)
-        # Try to click the button using JavaScript
-        browser.execute_script("arguments[0].click();", button)
+        # Scroll the button into view and click it through JavaScript, which
+        # does not depend on scroll animations having finished
+        browser.execute_script("arguments[0].scrollIntoView(true); arguments[0].click();", button)
         # Wait for the modal to appear
-        WebDriverWait(browser, 10).until(
-            EC.presence_of_element_located((By.CLASS_NAME, "twad414"))
-        )
+        if not select_elements(browser, "amenities_modal", list, [], deadline):
+            raise TimeoutException("the amenities modal did not open")
         logging.info("Successfully clicked 'Show all amenities' button")
+        metrics.AMENITIES_CLICKS.inc(outcome="opened")
         return True
     except (TimeoutException, NoSuchElementException, ElementClickInterceptedException) as e:
         logging.warning(f"Failed to click 'Show all amenities' button: {e}")
+        metrics.AMENITIES_CLICKS.inc(outcome="failed")
         return False
 
-def scrape_features(browser):
+def scrape_features(browser, deadline=None):
     # Try to click the "Show all amenities" button
-    if click_show_all_amenities(browser):
-        # If successful, scrape features from the modal
-        return [feature.text for feature in browser.find_elements(By.CLASS_NAME, "twad414")]
+    if click_show_all_amenities(browser, deadline):
+        # If successful, scrape features from the modal, whose selectors were
+        # already checked when it opened
+        return select_elements(browser, "amenities_modal", element_texts, [], record=False)
     else:
         # If unsuccessful, try to scrape features from the main page
-        return [feature.text for feature in browser.find_elements(By.XPATH, "//div[contains(@class, 'amenities')]//div[contains(@class, 'title')]")]
+        return select_elements(browser, "amenities_page", element_texts, [])
 
 def scrape_house_details(browser):
     logging.info(f"Scraped the details about the AirBnB.")
-    return [details.text for details in browser.find_elements(By.CLASS_NAME, "l7n4lsf")]
+    return select_elements(browser, "house_details", element_texts, [])
+
+def scrape_field(field, extractor, *args):
+    with metrics.FIELD_SECONDS.time(field=field):
+        return extractor(*args)
+
+def scrape_coordinates(browser):
+    # The map position is only in inline script data, not in any element
+    return extract.coordinates_from_source(browser.page_source)
+
+def scrape_place_details_from_elements(browser, url, deadline):
+    place = {"url": url, "title": scrape_field("title", select_elements, browser, "title", first_element_text, "", deadline),
+             "picture_url": scrape_field("picture_url", select_elements, browser, "picture_url", first_element_src, "", deadline),
+             "description": scrape_field("description", select_elements, browser, "description", first_element_text, "", deadline),
+             "price": scrape_field("price", select_elements, browser, "price", element_price, "", deadline),
+             "rating": scrape_field("rating", select_elements, browser, "rating", first_element_text, "", deadline),
+             "location": scrape_field("location", select_elements, browser, "location", first_element_text, "", deadline),
+             "features": scrape_field("features", scrape_features, browser, deadline),
+             "house_details": scrape_field("house_details", scrape_house_details, browser)}
+    place.update(scrape_field("coordinates", scrape_coordinates, browser))
+    return place
 
+def scrape_place_details_from_source(browser, url, deadline):
+    # One page_source transfer replaces a WebDriver round trip per field; the
+    # fields are then parsed locally.
+    deadline.until_or_none(browser, lambda b: b.execute_script(extract.FIELDS_READY_SCRIPT, extract.ready_selectors()), "listing fields")
+    click_show_all_amenities(browser, deadline)
+    return extract.extract_place(browser.page_source, url)
+
+@metrics.STAGE_SECONDS.time(stage="listing")
 def scrape_place_details(browser, url):
-    browser.get(url)
-    time.sleep(5)  # Wait for page to load
+    with metrics.STAGE_SECONDS.time(stage="page_load"):
+        scheduler.load(browser, url)
+        # Every wait on this page draws from one shared budget
+        deadline = PageDeadline(label=url)
+        deadline.until_or_none(browser, document_ready, "document ready")
+        deadline.until_or_none(browser, EC.presence_of_element_located((By.TAG_NAME, "h1")), "h1")
+
+    place = None
+    with metrics.STAGE_SECONDS.time(stage="extract"):
+        if EXTRACT_MODE == 'source':
+            place = scrape_place_details_from_source(browser, url, deadline)
+            if place is None:
+                logging.warning(f"Could not extract {url} from page source, falling back to element lookups")
+        if place is None:
+            place = scrape_place_details_from_elements(browser, url, deadline)
+
+    deadline.log_summary()
+    logging.info(f"Scraped details for: {place['title']}")
+    return place
 
-    place = {"url": url, "title": get_text_or_empty(browser, By.TAG_NAME, "h1"),
-             "picture_url": get_attribute_or_empty(browser, By.CLASS_NAME, "itu7ddv", "src"),
-             "description": get_text_or_empty(browser, By.CLASS_NAME, "l1h825yc"),
-             "price": get_price(browser, By.CLASS_NAME, "_j1kt73"),
-             "rating": get_text_or_empty(browser, By.CLASS_NAME, "r1dxllyb"),
-             "location": get_text_or_empty(browser, By.CLASS_NAME, "_152qbzi"),
-             "features": scrape_features(browser),
-             "house_details": scrape_house_details(browser)}
+RegionTask = namedtuple('RegionTask', ['region', 'country'])
 
-    # Scrape the features
 
-    logging.info(f"Scraped details for: {place['title']}")
-    return place
+def discover_shard(browser, shard):
+    logging.info(f"Searching listings for {shard_label(shard)}")
+    return get_place_urls(browser, shard.query, shard.price_min, shard.price_max)
+
 
-def scrape_region(browser, region, country):
-    logging.info(f"Scraping listings for {region}, {country}")
-    place_urls = get_place_urls(browser, f"{region}, {country}")
-    region_listings = []
-    for url in place_urls:
-        details = scrape_place_details(browser, url)
-        details['region'] = region
-        details['country'] = country
-        region_listings.append(details)
+def discover_shards(pool, shards):
+    results = ShardResults(shards)
+    for shard, urls in pool.imap_unordered(discover_shard, shards):
+        if isinstance(urls, TaskFailed):
+            results.fail(shard, urls.error)
+        else:
+            results.add(shard, urls)
+    return results
+
+
+def scrape_regions(pool, regions, fetcher, frontier=None, progress=None):
+    # Each region is searched as several shards (see sharding.py) on the pool's
+    # workers, while the listings of regions already discovered are fetched and
+    # streamed to the writer. Only as many shards are searched ahead as there
+    # are workers, so listing scrapes are not starved. Regions discovered within
+    # the freshness window are resumed from the frontier instead.
+    frontier = frontier or CrawlFrontier(DB_NAME)
+    progress = progress or Progress()
+    progress.set_regions(len(regions))
+    discovered = queue.Queue()
+    pending_regions = [RegionTask(region, country) for region, country in regions]
+    # Regions whose shards are still being searched, and regions ready to scrape
+    searching = {}
+    ready = deque()
+    written = {}
+    # Listing ids already taken by a region of this run. Search areas overlap
+    # (a city search can list rooms across a border), and a listing is scraped
+    # and counted for the first region that claims it only.
+    claimed = set()
+    shards_in_flight = 0
+
+    def submit_next_regions():
+        nonlocal shards_in_flight
+        while pending_regions and shards_in_flight < pool.size:
+            task = pending_regions.pop(0)
+            if frontier.region_is_fresh(task.region, task.country):
+                logging.info(f"Resuming {task.region}, {task.country} from the frontier")
+                ready.append((task, None))
+                continue
+            shards = region_shards(task.region, task.country)
+            searching[task] = ShardResults(shards)
+            for shard in shards:
+                pool.submit(discover_shard, shard, discovered)
+            shards_in_flight += len(shards)
+
+    def count_written(batch, ids):
+        thumbnail_prefetcher.submit(batch)
+        for listing in batch:
+            written[listing['country']] = written.get(listing['country'], 0) + 1
+
+    with ListingWriter(DB_NAME, COLLECTION_NAME, on_flush=count_written) as writer:
+        submit_next_regions()
+
+        while ready or searching:
+            progress.check_cancelled()
+            if not ready:
+                shard, urls = discovered.get()
+                shards_in_flight -= 1
+                task = RegionTask(shard.region, shard.country)
+                results = searching[task]
+                if isinstance(urls, TaskFailed):
+                    results.fail(shard, urls.error)
+                else:
+                    results.add(shard, urls)
+                if results.done():
+                    del searching[task]
+                    ready.append((task, results))
+                submit_next_regions()
+                continue
+
+            task, results = ready.popleft()
+            submit_next_regions()
+            place_urls = None
+            if results is not None:
+                if results.all_failed():
+                    logger.error(f"Failed to discover listings for {task.region}, {task.country}")
+                    progress.region_done()
+                    continue
+                place_urls = results.place_urls()
+                logging.info(f"Found {len(place_urls)} unique listings for {task.region}, {task.country} "
+                             f"in {len(results.report)} searches")
+                frontier.add_region_urls(task.region, task.country, place_urls, results.report)
+
+            urls_to_scrape = []
+            for url in frontier.urls_to_scrape(task.region, task.country, place_urls):
+                key = listing_id(url) or url
+                if key not in claimed:
+                    claimed.add(key)
+                    urls_to_scrape.append(url)
+            progress.urls_discovered(len(urls_to_scrape))
+            scraped = 0
+            for url, details in fetcher.fetch_many(urls_to_scrape):
+                progress.check_cancelled()
+                if isinstance(details, TaskFailed):
+                    logger.error(f"Failed to scrape {url}: {details.error}")
+                    frontier.mark_failed(url, details.error)
+                    progress.listing_failed()
+                    continue
+                details['region'] = task.region
+                details['country'] = task.country
+                # Blocks while the writer is behind
+                writer.put(details)
+                progress.listing_scraped()
+                scraped += 1
+            logging.info(f"Queued {scraped} listings for {task.region}, {task.country}")
+            progress.region_done()
+
+    return {country: written.get(country, 0) for _, country in regions}
+
+
+def scrape_region(pool, region, country, fetcher):
+    return scrape_regions(pool, [(region, country)], fetcher).get(country, 0)
+
+
+def get_pool_size(params):
+    # workers= within 1..SCRAPER_MAX_POOL_SIZE; raises ValueError if it is not a
+    # whole number
+    workers = params.get('workers')
+    if workers in (None, ''):
+        return POOL_SIZE
+    try:
+        workers = int(str(workers))
+    except (TypeError, ValueError):
+        raise ValueError("workers must be a whole number")
+    return max(1, min(MAX_POOL_SIZE, workers))
+
+
+def get_fetcher(pool, params):
+    return create_fetcher(params.get('fetcher') or FETCHER, pool, scrape_place_details)
+
+
+# Job runners: run on a job worker thread, return (summary, response)
+def run_north_america(params, progress):
+    regions = [(province, "Canada") for province in CANADIAN_PROVINCES]
+    regions += [(state, "USA") for state in US_STATES]
+
+    with BrowserPool(initialize_browser, size=get_pool_size(params)) as pool:
+        totals = scrape_regions(pool, regions, get_fetcher(pool, params), progress=progress)
+    # Region rollups were kept current while writing; countries and features
+    # are recomputed in one pass now that the crawl is complete
+    db.rebuild_rollups(DB_NAME, COLLECTION_NAME)
+
+    canada_listings = totals.get("Canada", 0)
+    us_listings = totals.get("USA", 0)
+    summary = {
+        "total_listings": canada_listings + us_listings,
+        "canada_listings": canada_listings,
+        "us_listings": us_listings,
+    }
+    return summary, {"message": "Scraping completed", **summary}
+
+
+def run_city(params, progress):
+    city = params['city']
+    progress.set_regions(1)
+    with BrowserPool(initialize_browser, size=get_pool_size(params)) as pool:
+        results = discover_shards(pool, region_shards(city, None))
+        if results.all_failed():
+            raise RuntimeError(f"Failed to discover listings for {city}")
+        place_urls = results.place_urls()
+
+        frontier = CrawlFrontier(DB_NAME)
+        frontier.add_region_urls(city, None, place_urls, results.report)
+        urls_to_scrape = frontier.urls_to_scrape(city, None, place_urls)
+        progress.urls_discovered(len(urls_to_scrape))
+
+        place_details = []
+        inserted_ids = []
+
+        def collect_written(batch, ids):
+            thumbnail_prefetcher.submit(batch)
+            inserted_ids.extend(ids)
+
+        with ListingWriter(DB_NAME, COLLECTION_NAME, on_flush=collect_written) as writer:
+            for url, details in get_fetcher(pool, params).fetch_many(urls_to_scrape):
+                progress.check_cancelled()
+                if isinstance(details, TaskFailed):
+                    logger.error(f"Failed to scrape {url}: {details.error}")
+                    frontier.mark_failed(url, details.error)
+                    progress.listing_failed()
+                    continue
+                place_details.append(details)
+                writer.put(details)
+                progress.listing_scraped()
+    progress.region_done()
+    # City listings count towards their country's and features' rollups, which
+    # are only kept current by full passes
+    if inserted_ids:
+        db.rebuild_rollups(DB_NAME, COLLECTION_NAME)
+
+    summary = {"city": city, "listings": len(inserted_ids)}
+    return summary, {"city": city, "places": place_details, "inserted_ids": inserted_ids}
+
+
+job_manager = JobManager(DB_NAME, {"north-america": run_north_america, "city": run_city})
+
+# Scraped listings get their thumbnail made in the background once written
+thumbnailer = thumbnails.Thumbnailer(DB_NAME, COLLECTION_NAME)
+thumbnail_prefetcher = thumbnails.ThumbnailPrefetcher(thumbnailer)
+JOB_PARAMS = ['city', 'workers', 'fetcher']
+
+
+def job_params(source):
+    # Raises ValueError for parameters a job could not run with
+    params = {name: source[name] for name in JOB_PARAMS if source.get(name) not in (None, '')}
+    if 'workers' in params:
+        params['workers'] = get_pool_size(params)
+    if 'fetcher' in params and params['fetcher'] not in FETCHER_NAMES:
+        raise ValueError(f"fetcher must be one of {', '.join(FETCHER_NAMES)}")
+    return params
+
+
+def job_links(job_id):
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+
+def run_job_request(kind, error_message):
+    # The scrape endpoints queue a job. By default they wait for it, as they
+    # always have, for up to SCRAPE_WAIT_TIMEOUT seconds; with wait=false they
+    # return the job id straight away.
+    try:
+        params = job_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('wait', 'true').lower() == 'false':
+        return jsonify(job_links(job_manager.submit(kind, params))), 202
 
-    # Write the listings for this region to the database
-    inserted_ids = db.insert_many_into_collection(DB_NAME, COLLECTION_NAME, region_listings)
-    logging.info(f"Inserted {len(inserted_ids)} listings for {region}, {country}")
+    job_id = job_manager.submit(kind, params, keep_result=True)
+    outcome = job_manager.wait(job_id, SCRAPE_WAIT_TIMEOUT)
+    if outcome is None:
+        return jsonify(job_links(job_id)), 202
+    if outcome["status"] != "completed":
+        return jsonify({"error": error_message, **job_links(job_id)}), 500
+    return jsonify(outcome["response"])
 
-    return len(inserted_ids)
 
 # Route handlers
 @app.route('/scrape-north-america', methods=['GET'])
 def scrape_north_america():
-    browser = initialize_browser()
+    return run_job_request("north-america", "Failed to scrape listings")
+
+
+@app.route('/scrape-city-data', methods=['GET'])
+def get_city_data():
+    if not request.args.get('city'):
+        return jsonify({"error": "City parameter is required"}), 400
+    return run_job_request("city", "Failed to scrape city data")
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    kind = body.get('kind')
     try:
-        total_listings = 0
-        canada_listings = 0
-        us_listings = 0
+        params = job_params(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if kind == 'city' and not params.get('city'):
+        return jsonify({"error": "City parameter is required"}), 400
+    try:
+        job_id = job_manager.submit(kind, params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(job_links(job_id)), 202
 
-        # Scrape Canadian provinces
-        for province in CANADIAN_PROVINCES:
-            canada_listings += scrape_region(browser, province, "Canada")
-            total_listings += canada_listings
 
-        # Scrape US states
-        for state in US_STATES:
-            us_listings += scrape_region(browser, state, "USA")
-            total_listings += us_listings
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(job_manager.list(int(request.args.get('limit', 20))))
 
-        return jsonify({
-            "message": "Scraping completed",
-            "total_listings": total_listings,
-            "canada_listings": canada_listings,
-            "us_listings": us_listings,
-        })
-    except Exception as e:
-        logger.error(f"An error occurred while scraping: {e}")
-        return jsonify({"error": "Failed to scrape listings"}), 500
-    finally:
-        browser.quit()
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if not job_manager.cancel(job_id):
+        return jsonify({"error": "Job is not queued or running"}), 409
+    return jsonify({"job_id": job_id, "cancelling": True})
 
-@app.route('/scrape-city-data', methods=['GET'])
-def get_city_data():
-    city = request.args.get('city')
-    if not city:
-        return jsonify({"error": "City parameter is required"}), 400
 
-    browser = initialize_browser()
+def int_arg(name, default):
+    # Raises ValueError if the parameter is given but not a whole number
+    value = request.args.get(name)
+    if value in (None, ''):
+        return default
     try:
-        place_urls = get_place_urls(browser, city)
-        place_details = []
-        for url in place_urls:
-            details = scrape_place_details(browser, url)
-            place_details.append(details)
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number")
 
-        inserted_ids = db.insert_many_into_collection(DB_NAME, COLLECTION_NAME, place_details)
 
-        return jsonify({
-            "city": city,
-            "places": json.loads(dumps(place_details)),
-            "inserted_ids": inserted_ids
-        })
-    finally:
-        browser.quit()
+def get_fields():
+    fields = request.args.get('fields', '')
+    if fields == 'summary':
+        return db.SUMMARY_FIELDS
+    return [field for field in fields.split(',') if FIELD_NAME.match(field)]
+
+
+def stream_json_array(first, rows):
+    if first is None:
+        yield '[]'
+        return
+    encode = json_encoder.encode
+    yield '[' + encode(first)
+    for row in rows:
+        yield ',' + encode(row)
+    yield ']'
 
 
 @app.route('/get-listings', methods=['GET'])
+@response_cache.cached
 def get_listings():
     city = request.args.get('city')
     limit = int(request.args.get('limit', 0))
+    # Keyset pagination: pass the _id of the last listing of the previous page
+    cursor = request.args.get('cursor')
+    if cursor and not ObjectId.is_valid(cursor):
+        return jsonify({"error": "Invalid cursor"}), 400
 
-    query = {}
+    try:
+        query = normalize.range_query(request.args)
+    except ValueError:
+        return jsonify({"error": "Range filters must be numbers"}), 400
     if city:
-        query["location"] = {"$regex": city, "$options": "i"}
+        query.update(normalize.location_query(city))
+    # Map views: near=lat,lng&radius_km=, or bbox=west,south,east,north
+    try:
+        query.update(geo.geo_query(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        listings = db.get_listings(DB_NAME, COLLECTION_NAME, query, limit)
-        return jsonify(listings)
+        rows = db.iter_listings(DB_NAME, COLLECTION_NAME, query, limit, cursor, get_fields())
+        first = next(rows, None)
     except Exception as e:
         logger.error(f"An error occurred while fetching listings: {e}")
         return jsonify({"error": "Failed to fetch listings"}), 500
 
+    # Rows are written out as the cursor yields them, so memory stays bounded
+    return Response(stream_with_context(stream_json_array(first, rows)), mimetype='application/json')
+
 
 @app.route('/filters', methods=['GET'])
+@response_cache.cached
 def get_filters():
     search_term = request.args.get('search', '')
     features = request.args.get('features', '').split(',') if request.args.get('features') else []
-    limit = int(request.args.get('limit', 10))
+    try:
+        limit = int_arg('limit', 10)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    query = {}
+    try:
+        query = normalize.range_query(request.args)
+    except ValueError:
+        return jsonify({"error": "Range filters must be numbers"}), 400
     if search_term:
-        query["location"] = {"$regex": search_term, "$options": "i"}
+        query.update(normalize.location_query(search_term))
     if features:
         query["features"] = {"$all": features}
+    try:
+        query.update(geo.geo_query(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         filters_result = db.get_filters(DB_NAME, COLLECTION_NAME, query, limit)
@@ -307,6 +681,7 @@ def get_filters():
 
 
 @app.route('/get-listing/<listing_id>', methods=['GET'])
+@response_cache.cached
 def get_listing(listing_id):
     try:
         listing = db.get_listing_by_id(DB_NAME, COLLECTION_NAME, listing_id)
@@ -335,15 +710,181 @@ def get_info():
 
 @app.route('/health', methods=['GET'])
 def health_check():
+    database = db.get_health()
+    healthy = database["status"] == "ok"
     return jsonify({
-        "status": "healthy",
-        "environment": config.ENV
-    }), 200
+        "status": "healthy" if healthy else "degraded",
+        "environment": config.ENV,
+        "database": database,
+        # Current browser fetch rate and concurrency, lowered after blocks
+        "fetch_scheduler": scheduler.stats()
+    }), 200 if healthy else 503
+
+
+@app.route('/regions', methods=['GET'])
+@response_cache.cached
+def get_regions():
+    return jsonify(db.get_regions(DB_NAME, COLLECTION_NAME))
+
+
+@app.route('/countries', methods=['GET'])
+@response_cache.cached
+def get_countries():
+    return jsonify(db.get_countries(DB_NAME, COLLECTION_NAME))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Labelled by route pattern, not path, so listing ids don't add series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(time.monotonic() - started, route=route,
+                                             method=request.method, status=response.status_code)
+    return response
+
+
+# Thumbnail URLs name their content, so clients may keep them for a year
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+THUMBNAIL_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+# How long clients may reuse a listing's redirect to its current thumbnail
+THUMBNAIL_REDIRECT_MAX_AGE = 3600
+
+
+def cacheable_redirect(location):
+    response = redirect(location)
+    response.cache_control.max_age = THUMBNAIL_REDIRECT_MAX_AGE
+    return response
+
+
+@app.route('/get-listing/<listing_id>/thumbnail', methods=['GET'])
+def get_listing_thumbnail(listing_id):
+    # Redirects to the listing's thumbnail, making it first if the background
+    # prefetch hasn't, or to the original picture if no thumbnail can be made
+    if not ObjectId.is_valid(listing_id):
+        return jsonify({"error": "Listing not found"}), 404
+    listing = db.get_listing_by_id(DB_NAME, COLLECTION_NAME, listing_id, db.THUMBNAIL_FIELDS)
+    if not listing:
+        return jsonify({"error": "Listing not found"}), 404
+    try:
+        digest = thumbnailer.ensure(listing)
+    except thumbnails.ThumbnailError as e:
+        logger.warning(f"Serving the original picture of {listing_id}: {e}")
+        original = thumbnailer.source_url(listing)
+        if not original:
+            return jsonify({"error": "Listing has no picture"}), 404
+        return cacheable_redirect(original)
+    return cacheable_redirect(url_for('get_thumbnail', digest=digest))
+
+
+@app.route('/thumbnails/<digest>.jpg', methods=['GET'])
+def get_thumbnail(digest):
+    if not THUMBNAIL_DIGEST.match(digest):
+        return jsonify({"error": "Thumbnail not found"}), 404
+    path = thumbnailer.cache.get(digest)
+    try:
+        if path is None:
+            raise FileNotFoundError(digest)
+        # Answers If-None-Match and If-Modified-Since with 304
+        response = send_file(path, mimetype='image/jpeg', etag=digest, conditional=True, max_age=THUMBNAIL_MAX_AGE)
+    except FileNotFoundError:
+        # Evicted since the client learned its URL; the original is still there
+        listing = db.get_listing_by_thumbnail(DB_NAME, COLLECTION_NAME, digest)
+        original = thumbnailer.source_url(listing) if listing else None
+        if not original:
+            return jsonify({"error": "Thumbnail not found"}), 404
+        return redirect(original)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+ROLLUP_KINDS = ("region", "country", "feature")
+
+
+@app.route('/stats', methods=['GET'])
+@response_cache.cached
+def get_stats():
+    # Precomputed price, rating and feature rollups: one region (region and
+    # country), country or feature, or with ?kind= the largest of that kind
+    region, country, feature = (request.args.get(name) for name in ("region", "country", "feature"))
+    if region or country or feature:
+        kind = "region" if region else "country" if country else "feature"
+        rollup = db.get_rollup(DB_NAME, kind, region, country, feature)
+        if rollup is None:
+            return jsonify({"error": "No statistics for this selection"}), 404
+        return jsonify(rollup)
+
+    kind = request.args.get('kind', 'region')
+    if kind not in ROLLUP_KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(ROLLUP_KINDS)}"}), 400
+    try:
+        limit = int_arg('limit', 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rollups = db.get_rollups(DB_NAME, kind, limit)
+    if rollups is None:
+        return jsonify({"error": "Failed to fetch statistics"}), 500
+    return jsonify(rollups)
+
+
+@app.route('/selectors', methods=['GET'])
+def get_selector_health():
+    return jsonify(SELECTORS.stats())
+
+
+@app.route('/frontier/dead-letters', methods=['GET'])
+def get_dead_letters():
+    # Listing URLs that failed in SCRAPER_DEAD_LETTER_FAILURES runs in a row
+    try:
+        limit = int_arg('limit', 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    dead_letters = db.get_dead_letters(DB_NAME, limit)
+    if dead_letters is None:
+        return jsonify({"error": "Failed to read the frontier"}), 500
+    return jsonify(dead_letters)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def prepare_listings():
+    # Duplicates removed while canonicalizing URLs leave the counts stale
+    _, removed = db.canonicalize_urls(DB_NAME, COLLECTION_NAME)
+    if db.backfill_derived_fields(DB_NAME, COLLECTION_NAME) or removed:
+        db.rebuild_rollups(DB_NAME, COLLECTION_NAME)
+    else:
+        db.ensure_rollups(DB_NAME, COLLECTION_NAME)
+    if removed:
+        db.rebuild_facets(DB_NAME, COLLECTION_NAME)
+    else:
+        db.ensure_facets(DB_NAME, COLLECTION_NAME)
 
 
 if __name__ == "__main__":
     logger.info(f"Starting {config.ENV} server on {config.HOST}:{config.PORT}")
     logger.info(f"CORS origins: {config.CORS_ORIGINS}")
+    db.ensure_indexes(DB_NAME, COLLECTION_NAME)
+    # With the debug reloader, this process only watches files and restarts the
+    # child that serves requests; background work belongs to that child
+    reloader_parent = config.ENV == 'development' and config.DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+    if not reloader_parent:
+        # Listings written before the search fields existed become searchable as the
+        # backfill reaches them, and the facet catalogue is built on first start;
+        # the server does not wait for either
+        threading.Thread(target=prepare_listings, name="listings-backfill", daemon=True).start()
+        # Scrapes run on the job workers; jobs left unfinished by the last run resume
+        job_manager.start()
+        if thumbnails.THUMBNAIL_PREFETCH:
+            thumbnail_prefetcher.start()
 
     if config.ENV == 'development':
         # Use Flask's development server
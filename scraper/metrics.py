@@ -0,0 +1,159 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, spanning fast local parses to the 20s page budget
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = sorted(self.series.items())
+            lines += [line for values, value in series for line in self.render_series(values, value)]
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        if not self.labels:
+            self.series[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render_series(self, values, value):
+        yield f"{self.name}{format_labels(self.labels, values)} {format_number(value)}"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[self.label_values(labels)] = value
+
+    def render_series(self, values, value):
+        yield f"{self.name}{format_labels(self.labels, values)} {format_number(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, seconds, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total = self.series.get(key) or ([0] * len(self.buckets), 0.0)
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+                    break
+            self.series[key] = (counts, total + seconds)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def totals(self):
+        # Label values -> (observations, total seconds)
+        with self.lock:
+            return {values: (sum(counts), total) for values, (counts, total) in self.series.items()}
+
+    def render_series(self, values, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = format_labels(self.labels, values, [("le", format_number(bound))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        yield f"{self.name}_sum{format_labels(self.labels, values)} {format_number(total)}"
+        yield f"{self.name}_count{format_labels(self.labels, values)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Scrape stages: search_page (one results page), place_urls (a whole search),
+# page_load, extract, listing (a whole listing), http_fetch and http_extract
+# (the HTTP fetcher) and db_write (one batch)
+STAGE_SECONDS = REGISTRY.histogram(
+    "scraper_stage_seconds", "Time spent in each scrape stage.", ["stage"])
+FIELD_SECONDS = REGISTRY.histogram(
+    "scraper_field_seconds", "Time spent extracting each listing field through element lookups.", ["field"])
+SELECTOR_WAIT_SECONDS = REGISTRY.histogram(
+    "scraper_selector_wait_seconds", "Time spent waiting on each page condition.", ["selector", "outcome"])
+SELECTOR_TIMEOUTS = REGISTRY.counter(
+    "scraper_selector_timeouts_total", "Page condition waits that ran out of time.", ["selector"])
+AMENITIES_CLICKS = REGISTRY.counter(
+    "scraper_amenities_modal_total", "Attempts to open the amenities modal.", ["outcome"])
+LISTINGS_WRITTEN = REGISTRY.counter(
+    "scraper_listings_written_total", "Listings upserted into MongoDB.")
+LISTING_WRITE_FAILURES = REGISTRY.counter(
+    "scraper_listing_write_failures_total", "Listings whose batch failed to be written.")
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "HTTP request latency by route.", ["route", "method", "status"])
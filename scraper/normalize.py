@@ -0,0 +1,160 @@
+import re
+
+import geo
+
+# Bumped whenever derived_fields changes, so the backfill knows which stored
+# listings need their derived fields recomputed.
+DERIVED_VERSION = 5
+# Scraped fields derived_fields reads from
+SOURCE_FIELDS = ["location", "region", "country", "price", "rating", "house_details", "latitude", "longitude"]
+
+# Currency markers as they appear in price strings, longest first
+CURRENCIES = [("CA$", "CAD"), ("C$", "CAD"), ("US$", "USD"), ("MX$", "MXN"), ("$", "USD"),
+              ("€", "EUR"), ("£", "GBP")]
+PRICE_PERIODS = {"night": "night", "nights": "night", "week": "week", "weeks": "week", "month": "month",
+                 "months": "month", "year": "year", "total": "total"}
+# house_details unit -> numeric field
+HOUSE_DETAIL_UNITS = {"bedroom": "bedrooms", "bedrooms": "bedrooms", "bed": "beds", "beds": "beds",
+                      "bath": "baths", "baths": "baths", "bathroom": "baths", "bathrooms": "baths",
+                      "guest": "guests", "guests": "guests"}
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+_AMOUNT = r"\d[\d,]*(?:\.\d+)?"
+_MARKERS = "|".join(re.escape(marker) for marker, _ in CURRENCIES)
+# An amount with its currency marker, and the period right after it: "$150 night",
+# "$150 / night", "$120 x 5 nights"
+_PRICE = re.compile(rf"(?:(?P<prefix>{_MARKERS})\s?(?P<amount>{_AMOUNT})|(?P<suffixed>{_AMOUNT})\s?(?P<suffix>[€£]))"
+                    rf"(?:\s*(?:/|per|a|x\s*\d+)?\s*(?P<period>[a-z]+))?", re.IGNORECASE)
+# A score out of 5 that is not a review count: "4.92", "★5 ·", "5.0 (12)"
+_RATING = re.compile(r"(?<![\d.,(])(★\s*)?([0-5](?:\.\d+)?)(?![\d,.])(?!\s*(?:reviews?\b|\)))(\s*[·★])?",
+                     re.IGNORECASE)
+_REVIEWS = re.compile(r"(\d[\d,]*)\s*reviews?|\((\d[\d,]*)\)", re.IGNORECASE)
+_HOUSE_DETAIL = re.compile(r"(\d+(?:\.\d+)?|half)\+?[-\s]+(?:[a-z]+\s+)?(bedrooms?|beds?|bathrooms?|baths?|guests?)\b",
+                           re.IGNORECASE)
+
+
+def normalize_text(value):
+    return " ".join((value or "").lower().split())
+
+
+def word_suffixes(value):
+    # "new york, united states" -> ["new york, united states", "york, united states",
+    # "united states", "states"]. An anchored prefix match on these finds any
+    # search term that starts at a word boundary while still using the index.
+    text = normalize_text(value)
+    return [text[match.start():] for match in _WORD.finditer(text)]
+
+
+def search_fields(document):
+    location = document.get("location") or ""
+    return {
+        "location_norm": normalize_text(location),
+        "location_terms": word_suffixes(location),
+        "region_norm": normalize_text(document.get("region")),
+        "country_norm": normalize_text(document.get("country")),
+    }
+
+
+def to_number(text):
+    return float(text.replace(",", ""))
+
+
+def price_groups(text):
+    # Amounts with a currency marker, grouped so each group ends at an amount
+    # followed by its period: "$1,500 $1,234 month" is one group, where the
+    # discounted last amount is the one charged
+    groups, group = [], []
+    for match in _PRICE.finditer(text):
+        marker = match.group("prefix") or match.group("suffix")
+        amount = match.group("amount") or match.group("suffixed")
+        period = PRICE_PERIODS.get((match.group("period") or "").lower())
+        group.append((to_number(amount), dict(CURRENCIES)[marker.upper()], period))
+        if period:
+            groups.append(group[-1])
+            group = []
+    if group:
+        groups.append(group[-1])
+    return groups
+
+
+def parse_price(price):
+    # "$1,234 month" -> 1234.0, "USD", "month"; "$150 night · $1,050 total" ->
+    # the nightly rate. A total is only used when no rate is shown.
+    groups = price_groups(price or "")
+    value, currency, period = next((group for group in groups if group[2] not in (None, "total")),
+                                   groups[-1] if groups else (None, None, None))
+    return {
+        "price_value": value,
+        "price_currency": currency,
+        "price_period": period,
+    }
+
+
+def parse_rating(rating):
+    # "4.92 · 120 reviews" -> 4.92, 120. Listings without reviews show "New",
+    # or only a review count.
+    text = rating or ""
+    value = next((match.group(2) for match in _RATING.finditer(text)
+                  if "." in match.group(2) or match.group(1) or match.group(3)
+                  or text.strip() == match.group(2)), None)
+    reviews = _REVIEWS.search(text)
+    return {
+        "rating_value": float(value) if value else None,
+        "review_count": int(to_number(reviews.group(1) or reviews.group(2))) if reviews else None,
+    }
+
+
+def parse_house_details(house_details):
+    # ["3 bedrooms", "2 baths", "4 beds"] -> bedrooms 3, baths 2, beds 4
+    details = dict.fromkeys(["bedrooms", "beds", "baths", "guests"])
+    text = " · ".join(house_details or [])
+    for amount, unit in _HOUSE_DETAIL.findall(text):
+        value = 0.5 if amount.lower() == "half" else to_number(amount)
+        details[HOUSE_DETAIL_UNITS[unit.lower()]] = value
+    if details["bedrooms"] is None and "studio" in text.lower():
+        details["bedrooms"] = 0.0
+    return details
+
+
+def numeric_fields(document):
+    return {**parse_price(document.get("price")),
+            **parse_rating(document.get("rating")),
+            **parse_house_details(document.get("house_details"))}
+
+
+def derived_fields(document):
+    # Fields computed from the scraped strings at write time; the strings
+    # themselves are stored unchanged
+    return {**search_fields(document), **numeric_fields(document), **geo.geo_fields(document),
+            "derived_version": DERIVED_VERSION}
+
+
+def prefix_regex(term):
+    return {"$regex": "^" + re.escape(normalize_text(term))}
+
+
+def location_query(term):
+    prefix = prefix_regex(term)
+    return {"$or": [{"location_terms": prefix}, {"region_norm": prefix}, {"country_norm": prefix}]}
+
+
+# Query parameter -> (numeric field, operator) for listing range filters
+RANGE_FILTERS = {
+    "price_min": ("price_value", "$gte"),
+    "price_max": ("price_value", "$lte"),
+    "rating_min": ("rating_value", "$gte"),
+    "bedrooms_min": ("bedrooms", "$gte"),
+    "beds_min": ("beds", "$gte"),
+    "baths_min": ("baths", "$gte"),
+    "guests_min": ("guests", "$gte"),
+}
+
+
+def range_query(args):
+    # Raises ValueError for a parameter that is not a number
+    query = {}
+    for param, (field, operator) in RANGE_FILTERS.items():
+        value = args.get(param)
+        if value not in (None, ""):
+            query.setdefault(field, {})[operator] = float(value)
+    return query
@@ -0,0 +1,137 @@
+import logging
+import os
+import queue
+import threading
+
+from selenium.common.exceptions import WebDriverException
+
+logger = logging.getLogger(__name__)
+
+# Number of browser sessions driven in parallel and how many pages a single
+# session may load before it is torn down and replaced to cap Chrome's memory.
+POOL_SIZE = int(os.getenv('SCRAPER_POOL_SIZE', 4))
+# Most sessions a single scrape may ask for with workers=
+MAX_POOL_SIZE = int(os.getenv('SCRAPER_MAX_POOL_SIZE', 16))
+MAX_PAGES_PER_BROWSER = int(os.getenv('SCRAPER_MAX_PAGES_PER_BROWSER', 50))
+MAX_TASK_RETRIES = int(os.getenv('SCRAPER_MAX_TASK_RETRIES', 1))
+
+_STOP = object()
+
+
+class TaskFailed:
+    def __init__(self, item, error):
+        self.item = item
+        self.error = error
+
+
+class _Worker(threading.Thread):
+    def __init__(self, pool, index):
+        super().__init__(name=f"scrape-worker-{index}", daemon=True)
+        self.pool = pool
+        self.browser = None
+        self.pages = 0
+
+    def ensure_browser(self):
+        if self.browser is None:
+            self.browser = self.pool.browser_factory()
+            self.pages = 0
+        return self.browser
+
+    def recycle(self, reason):
+        if self.browser is not None:
+            logger.info(f"{self.name}: recycling browser ({reason})")
+            try:
+                self.browser.quit()
+            except Exception as e:
+                logger.warning(f"{self.name}: error while quitting browser: {e}")
+        self.browser = None
+        self.pages = 0
+
+    def run(self):
+        try:
+            while True:
+                task = self.pool.tasks.get()
+                if task is _STOP:
+                    break
+                func, item, result_queue = task
+                result_queue.put(self.execute(func, item))
+        finally:
+            self.recycle("worker stopped")
+
+    def execute(self, func, item):
+        attempts = 0
+        while True:
+            browser = self.ensure_browser()
+            try:
+                result = func(browser, item)
+                self.pages += 1
+                if self.pages >= self.pool.max_pages_per_browser:
+                    self.recycle(f"reached {self.pages} pages")
+                return item, result
+            except WebDriverException as e:
+                # A crashed or wedged session is never reused
+                self.recycle(f"webdriver error: {e.__class__.__name__}")
+                attempts += 1
+                if attempts > self.pool.max_retries:
+                    logger.error(f"{self.name}: giving up on {item!r}: {e}")
+                    return item, TaskFailed(item, e)
+            except Exception as e:
+                logger.error(f"{self.name}: task {item!r} failed: {e}")
+                return item, TaskFailed(item, e)
+
+
+class BrowserPool:
+    def __init__(self, browser_factory, size=POOL_SIZE, max_pages_per_browser=MAX_PAGES_PER_BROWSER,
+                 max_retries=MAX_TASK_RETRIES):
+        self.browser_factory = browser_factory
+        self.size = max(1, size)
+        self.max_pages_per_browser = max(1, max_pages_per_browser)
+        self.max_retries = max_retries
+        self.tasks = queue.Queue()
+        self.workers = []
+
+    def start(self):
+        for index in range(self.size):
+            worker = _Worker(self, index)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"Started browser pool with {self.size} workers")
+        return self
+
+    def submit(self, func, item, result_queue):
+        # func(browser, item) runs on the next free worker; (item, result) is put
+        # on result_queue, with a TaskFailed result if the task raised.
+        self.tasks.put((func, item, result_queue))
+
+    def imap_unordered(self, func, items):
+        # Keeps at most two tasks per worker queued, so a consumer that stops
+        # reading (e.g. because writes are backing up) also stops the workers.
+        result_queue = queue.Queue()
+        items = iter(items)
+        outstanding = 0
+        for item in items:
+            self.submit(func, item, result_queue)
+            outstanding += 1
+            if outstanding >= self.size * 2:
+                break
+        while outstanding:
+            yield result_queue.get()
+            outstanding -= 1
+            for item in items:
+                self.submit(func, item, result_queue)
+                outstanding += 1
+                break
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.tasks.put(_STOP)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        logger.info("Browser pool shut down")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
@@ -0,0 +1,68 @@
+import logging
+import os
+import time
+
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.webdriver.support.ui import WebDriverWait
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Total time a single page may spend waiting on selectors, shared by every wait
+# made against that page. Once it is spent, each further lookup is checked once
+# and returns immediately instead of blocking for its own timeout.
+PAGE_DEADLINE = float(os.getenv('SCRAPER_PAGE_DEADLINE', 20))
+POLL_FREQUENCY = float(os.getenv('SCRAPER_POLL_FREQUENCY', 0.1))
+
+
+def document_ready(browser):
+    return browser.execute_script("return document.readyState") == "complete"
+
+
+class PageDeadline:
+    def __init__(self, budget=PAGE_DEADLINE, label=""):
+        self.label = label
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.waits = []
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() == 0.0
+
+    def until(self, browser, condition, name, cap=None):
+        # Waits for condition within what is left of the page budget (or less, if
+        # cap is given) and records how long it took. Raises TimeoutException like
+        # WebDriverWait does.
+        timeout = self.remaining() if cap is None else min(cap, self.remaining())
+        start = time.monotonic()
+        found = False
+        try:
+            result = WebDriverWait(browser, timeout, poll_frequency=POLL_FREQUENCY).until(condition)
+            found = True
+            return result
+        finally:
+            seconds = time.monotonic() - start
+            self.waits.append((name, seconds, found))
+            metrics.SELECTOR_WAIT_SECONDS.observe(seconds, selector=name, outcome="hit" if found else "miss")
+            if not found:
+                metrics.SELECTOR_TIMEOUTS.inc(selector=name)
+
+    def until_or_none(self, browser, condition, name, cap=None):
+        try:
+            return self.until(browser, condition, name, cap)
+        except (TimeoutException, NoSuchElementException):
+            return None
+
+    def total_wait(self):
+        return sum(seconds for _, seconds, _ in self.waits)
+
+    def log_summary(self):
+        misses = [name for name, _, found in self.waits if not found]
+        logger.info(f"Waited {self.total_wait():.2f}s on {len(self.waits)} conditions for {self.label}"
+                    f"{f' (missing: {misses})' if misses else ''}")
+        for name, seconds, found in self.waits:
+            logger.debug(f"  {name}: {seconds:.3f}s {'hit' if found else 'miss'}")
@@ -0,0 +1,153 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Most common features kept per region and country rollup, with the share of
+# listings that have them
+ROLLUP_TOP_FEATURES = int(os.getenv('ROLLUP_TOP_FEATURES', 25))
+
+# Listing fields a rollup is computed from
+ROLLUP_FIELDS = ["region", "country", "features", "price_value", "price_currency", "price_period", "rating_value"]
+
+
+def rollup_id(kind, region=None, country=None, feature=None):
+    if kind == "region":
+        return f"region:{region}|{country}"
+    if kind == "country":
+        return f"country:{country}"
+    return f"feature:{feature}"
+
+
+class ListingColumns:
+    # The rollup fields of many listings as arrays. Regions, countries and
+    # features are stored as integer codes into the *_names lists; code 0 of
+    # regions and countries is "missing". Features are kept flat: the n-th
+    # feature occurrence belongs to listing feature_listing[n]. Prices are only
+    # comparable within a currency and period, so each has a price_key code
+    # into price_keys, a list of (currency, period) pairs.
+    def __init__(self, documents):
+        prices, ratings, region_code, country_code, price_key = [], [], [], [], []
+        regions, countries, features, price_keys = {None: 0}, {None: 0}, {}, {}
+        feature_listing, feature_code = [], []
+        for index, document in enumerate(documents):
+            prices.append(document.get("price_value"))
+            price_key.append(price_keys.setdefault((document.get("price_currency"), document.get("price_period")),
+                                                   len(price_keys)))
+            ratings.append(document.get("rating_value"))
+            region_code.append(regions.setdefault(document.get("region") or None, len(regions)))
+            country_code.append(countries.setdefault(document.get("country") or None, len(countries)))
+            for feature in set(document.get("features") or []):
+                if feature:
+                    feature_listing.append(index)
+                    feature_code.append(features.setdefault(feature, len(features)))
+        self.price = np.array(prices, dtype=float)
+        self.rating = np.array(ratings, dtype=float)
+        self.region_code = np.array(region_code, dtype=np.int64)
+        self.country_code = np.array(country_code, dtype=np.int64)
+        self.price_key = np.array(price_key, dtype=np.int64)
+        self.feature_listing = np.array(feature_listing, dtype=np.int64)
+        self.feature_code = np.array(feature_code, dtype=np.int64)
+        self.region_names = list(regions)
+        self.country_names = list(countries)
+        self.feature_names = list(features)
+        self.price_keys = list(price_keys)
+
+    def __len__(self):
+        return len(self.price)
+
+
+def split_groups(labels):
+    # Indices of every distinct label, from one sort instead of a mask per label
+    order = np.argsort(labels, kind="stable")
+    values, starts = np.unique(labels[order], return_index=True)
+    return zip(values, np.split(order, starts[1:]))
+
+
+def feature_counts(columns, groups):
+    # Per group, how many of its listings have each feature: one row per group
+    # of listing indices, counted in a single pass over the feature occurrences
+    group_of = np.full(len(columns), -1, dtype=np.int64)
+    for number, listings in enumerate(groups):
+        group_of[listings] = number
+    occurrence_group = group_of[columns.feature_listing]
+    grouped = occurrence_group >= 0
+    features = len(columns.feature_names)
+    counts = np.bincount(occurrence_group[grouped] * features + columns.feature_code[grouped],
+                         minlength=len(groups) * features)
+    return counts.reshape(len(groups), features)
+
+
+def price_summaries(columns, listings):
+    # Price statistics per currency and period, most listings first
+    prices = columns.price[listings]
+    priced = ~np.isnan(prices)
+    prices, keys = prices[priced], columns.price_key[listings][priced]
+    summaries = []
+    for key, indices in split_groups(keys):
+        group = prices[indices]
+        currency, period = columns.price_keys[key]
+        summaries.append({
+            "currency": currency,
+            "period": period,
+            "count": int(len(group)),
+            "min": float(group.min()),
+            "median": float(np.median(group)),
+            "p90": round(float(np.percentile(group, 90)), 2),
+        })
+    return sorted(summaries, key=lambda summary: -summary["count"])
+
+
+def summarize(columns, listings, features=None):
+    # Statistics over the listings at the given indices of columns; features is
+    # their row of feature_counts, if feature prevalence is wanted
+    ratings = columns.rating[listings]
+    ratings = ratings[~np.isnan(ratings)]
+    summary = {
+        "count": int(len(listings)),
+        "prices": price_summaries(columns, listings),
+        "rating": {
+            "count": int(len(ratings)),
+            "average": round(float(ratings.mean()), 3) if len(ratings) else None,
+        },
+    }
+    if features is not None:
+        top = np.argsort(-features, kind="stable")[:ROLLUP_TOP_FEATURES]
+        summary["features"] = {columns.feature_names[code]: round(float(features[code]) / len(listings), 4)
+                               for code in top if features[code]}
+    return summary
+
+
+def compute_rollups(columns, kinds=("region", "country", "feature")):
+    # Every rollup of the given kinds, as documents ready to be stored
+    now = datetime.now(timezone.utc)
+    rollups = []
+    if not len(columns):
+        return rollups
+    if "region" in kinds:
+        # The same region name may exist in several countries
+        pairs = columns.region_code * len(columns.country_names) + columns.country_code
+        regions = {}
+        for pair, listings in split_groups(pairs):
+            region, country = divmod(int(pair), len(columns.country_names))
+            if region:
+                regions[(columns.region_names[region], columns.country_names[country])] = listings
+        counts = feature_counts(columns, list(regions.values()))
+        for ((region, country), listings), features in zip(regions.items(), counts):
+            rollups.append({"_id": rollup_id("region", region, country), "kind": "region",
+                            "region": region, "country": country,
+                            **summarize(columns, listings, features), "updated_at": now})
+    if "country" in kinds:
+        countries = {columns.country_names[country]: listings
+                     for country, listings in split_groups(columns.country_code) if country}
+        counts = feature_counts(columns, list(countries.values()))
+        for (country, listings), features in zip(countries.items(), counts):
+            rollups.append({"_id": rollup_id("country", country=country), "kind": "country",
+                            "country": country, **summarize(columns, listings, features), "updated_at": now})
+    if "feature" in kinds and len(columns.feature_code):
+        for code, occurrences in split_groups(columns.feature_code):
+            feature = columns.feature_names[code]
+            rollups.append({"_id": rollup_id("feature", feature=feature), "kind": "feature",
+                            "feature": feature, **summarize(columns, columns.feature_listing[occurrences]),
+                            "updated_at": now})
+    return rollups
@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A selector that missed on each of its last SELECTOR_HEALTH_WINDOW attempts is
+# considered broken and skipped, so a rotated class name stops costing a wait
+# on every listing. It is still tried once every SELECTOR_PROBE_INTERVAL times
+# it would have been used, to notice when it works again.
+SELECTOR_HEALTH_WINDOW = int(os.getenv('SELECTOR_HEALTH_WINDOW', 20))
+SELECTOR_PROBE_INTERVAL = int(os.getenv('SELECTOR_PROBE_INTERVAL', 25))
+
+
+def class_xpath(class_name):
+    return f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+# Field -> XPath selectors in the order they are tried. The obfuscated class
+# names come first; the fallbacks rely on semantic markup, ARIA labels and the
+# data-section-id / data-testid attributes, which change far less often.
+FIELD_SELECTORS = {
+    "result_link": [class_xpath("atm_7l_1j28jx2"),
+                    "//*[@data-testid='card-container']//a[contains(@href, '/rooms/')]",
+                    "//a[contains(@href, '/rooms/')]"],
+    "title": ["//h1"],
+    "picture_url": [class_xpath("itu7ddv"),
+                    "//div[@data-section-id='HERO_DEFAULT']//img",
+                    "//img[@data-original-uri]"],
+    "description": [class_xpath("l1h825yc"),
+                    "//div[@data-section-id='DESCRIPTION_DEFAULT']//span[normalize-space()]"],
+    "price": [class_xpath("_j1kt73"),
+              "//*[@data-testid='price-element']//span",
+              "//div[@data-section-id='BOOK_IT_SIDEBAR']//span[contains(., '$')]"],
+    "rating": [class_xpath("r1dxllyb"),
+               "//*[@data-testid='pdp-reviews-highlight-banner-host-rating']",
+               "//div[@data-section-id='REVIEWS_DEFAULT']//h2"],
+    "location": [class_xpath("_152qbzi"),
+                 "//div[@data-section-id='LOCATION_DEFAULT']//section//div[contains(., ',')][not(*)]"],
+    # Only present once "Show all amenities" was clicked
+    "amenities_modal": [class_xpath("twad414"),
+                        "//div[@role='dialog']//li//div[@id][not(*)]"],
+    "amenities_page": ["//div[contains(@class, 'amenities')]//div[contains(@class, 'title')]",
+                       "//div[@data-section-id='AMENITIES_DEFAULT']//div[@id][not(*)]"],
+    "house_details": [class_xpath("l7n4lsf"),
+                      "//div[@data-section-id='OVERVIEW_DEFAULT_V2']//ol/li"],
+}
+
+SELECTOR_ATTEMPTS = metrics.REGISTRY.counter(
+    "scraper_selector_attempts_total", "Field selector lookups by outcome.", ["field", "selector", "outcome"])
+
+
+class SelectorHealth:
+    def __init__(self, window=SELECTOR_HEALTH_WINDOW):
+        self.recent = deque(maxlen=window)
+        self.hits = 0
+        self.attempts = 0
+        self.skipped = 0
+
+    def record(self, hit):
+        self.recent.append(hit)
+        self.attempts += 1
+        self.hits += hit
+
+    def broken(self):
+        return len(self.recent) == self.recent.maxlen and not any(self.recent)
+
+    def stats(self):
+        return {
+            "attempts": self.attempts,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.attempts, 3) if self.attempts else None,
+            "recent_hit_rate": round(sum(self.recent) / len(self.recent), 3) if self.recent else None,
+            "broken": self.broken(),
+        }
+
+
+class SelectorRegistry:
+    def __init__(self, field_selectors=FIELD_SELECTORS, probe_interval=SELECTOR_PROBE_INTERVAL):
+        self.field_selectors = field_selectors
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self.health = {(field, selector): SelectorHealth()
+                       for field, selectors in field_selectors.items() for selector in selectors}
+
+    def candidates(self, field):
+        # Selectors to try for field, in order: the healthy ones, plus a broken
+        # one when it is due for a probe. Returns (selector, probe) pairs; probes
+        # should be checked without waiting.
+        chosen = []
+        with self.lock:
+            for selector in self.field_selectors[field]:
+                health = self.health[(field, selector)]
+                if not health.broken():
+                    chosen.append((selector, False))
+                    continue
+                health.skipped += 1
+                if health.skipped % self.probe_interval == 0:
+                    chosen.append((selector, True))
+        return chosen
+
+    def healthy(self, field):
+        with self.lock:
+            return [selector for selector in self.field_selectors[field]
+                    if not self.health[(field, selector)].broken()]
+
+    def record(self, field, selector, hit):
+        with self.lock:
+            health = self.health[(field, selector)]
+            was_broken = health.broken()
+            health.record(bool(hit))
+            broken = health.broken()
+        SELECTOR_ATTEMPTS.inc(field=field, selector=selector, outcome="hit" if hit else "miss")
+        if broken and not was_broken:
+            logger.warning(f"Selector for {field} missed {SELECTOR_HEALTH_WINDOW} times in a row, "
+                           f"skipping it: {selector}")
+        elif was_broken and not broken:
+            logger.info(f"Selector for {field} works again: {selector}")
+
+    def select(self, field, find, pick, empty, record=True):
+        # Returns pick(find(selector)) for the first selector whose result is
+        # not empty, recording a hit or miss for every selector tried. Lookups
+        # of elements that may legitimately be absent pass record=False.
+        for selector, _ in self.candidates(field):
+            value = pick(find(selector))
+            if record:
+                self.record(field, selector, value)
+            if value:
+                return value
+        return empty
+
+    def stats(self):
+        with self.lock:
+            return {field: {selector: self.health[(field, selector)].stats() for selector in selectors}
+                    for field, selectors in self.field_selectors.items()}
+
+
+SELECTORS = SelectorRegistry()
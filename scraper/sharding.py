@@ -0,0 +1,108 @@
+import logging
+import os
+import re
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# A search only shows a limited number of results, so large regions are also
+# searched city by city. The region-wide search still runs and catches the rest.
+SUBREGIONS = {
+    ("California", "USA"): ["Los Angeles", "San Diego", "San Francisco", "San Jose", "Sacramento",
+                            "Palm Springs", "Lake Tahoe", "Big Bear Lake", "Santa Barbara", "Monterey"],
+    ("Texas", "USA"): ["Houston", "Austin", "Dallas", "San Antonio", "Fort Worth", "El Paso",
+                       "Galveston", "South Padre Island", "Fredericksburg"],
+    ("Florida", "USA"): ["Miami", "Orlando", "Tampa", "Jacksonville", "Key West", "Destin",
+                         "Panama City Beach", "Naples", "St. Augustine"],
+    ("New York", "USA"): ["New York City", "Brooklyn", "Buffalo", "Lake Placid", "The Hamptons",
+                          "Catskills", "Finger Lakes"],
+    ("North Carolina", "USA"): ["Asheville", "Charlotte", "Raleigh", "Outer Banks", "Wilmington"],
+    ("Colorado", "USA"): ["Denver", "Colorado Springs", "Breckenridge", "Estes Park", "Vail", "Aspen"],
+    ("Arizona", "USA"): ["Phoenix", "Scottsdale", "Tucson", "Sedona", "Flagstaff"],
+    ("Tennessee", "USA"): ["Nashville", "Gatlinburg", "Pigeon Forge", "Memphis", "Chattanooga"],
+    ("Ontario", "Canada"): ["Toronto", "Ottawa", "Niagara Falls", "Blue Mountains", "Muskoka"],
+    ("British Columbia", "Canada"): ["Vancouver", "Victoria", "Whistler", "Kelowna", "Tofino"],
+}
+
+# Nightly price bands every shard is additionally split into, e.g.
+# "0-150,150-300,300-" (an open upper bound is allowed). Empty disables them.
+PRICE_BANDS = os.getenv('SCRAPER_SHARD_PRICE_BANDS', '')
+
+Shard = namedtuple('Shard', ['region', 'country', 'query', 'price_min', 'price_max'])
+
+_LISTING_ID = re.compile(r"/rooms/(?:plus/|luxury/)?(\d+)")
+
+
+def parse_price_bands(value):
+    bands = []
+    for band in filter(None, (part.strip() for part in value.split(','))):
+        low, _, high = band.partition('-')
+        bands.append((int(low) if low else None, int(high) if high else None))
+    return bands
+
+
+def shard_label(shard):
+    if shard.price_min is None and shard.price_max is None:
+        return shard.query
+    return f"{shard.query} (${shard.price_min or 0}-{shard.price_max or ''})"
+
+
+def region_shards(region, country, price_bands=PRICE_BANDS):
+    # country is None for a free-text search such as a city
+    place = f"{region}, {country}" if country else region
+    queries = [place] + [f"{city}, {place}" for city in SUBREGIONS.get((region, country), [])]
+    bands = parse_price_bands(price_bands) or [(None, None)]
+    return [Shard(region, country, query, low, high) for query in queries for low, high in bands]
+
+
+def listing_id(url):
+    match = _LISTING_ID.search(url)
+    return match.group(1) if match else None
+
+
+def canonical_url(url):
+    # Search results link to the same listing with varying query parameters
+    listing = listing_id(url)
+    if listing is None:
+        return url
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/rooms/{listing}"
+
+
+class ShardResults:
+    # Merges the URLs found by the shards of one region, deduplicated by
+    # listing id, and keeps how much each shard found and added
+    def __init__(self, shards):
+        self.pending = len(shards)
+        self.urls = {}
+        self.report = []
+        self.failed = 0
+
+    def add(self, shard, urls):
+        self.pending -= 1
+        added = 0
+        for url in urls:
+            key = listing_id(url) or url
+            if key not in self.urls:
+                self.urls[key] = canonical_url(url)
+                added += 1
+        self.report.append({"query": shard.query, "price_min": shard.price_min, "price_max": shard.price_max,
+                            "results": len(urls), "added": added})
+        logger.info(f"Shard {shard_label(shard)}: {len(urls)} results, {added} new")
+
+    def fail(self, shard, error):
+        self.pending -= 1
+        self.failed += 1
+        self.report.append({"query": shard.query, "price_min": shard.price_min, "price_max": shard.price_max,
+                            "error": str(error)})
+        logger.error(f"Shard {shard_label(shard)} failed: {error}")
+
+    def done(self):
+        return self.pending == 0
+
+    def all_failed(self):
+        return self.failed == len(self.report)
+
+    def place_urls(self):
+        return list(self.urls.values())
@@ -0,0 +1,52 @@
+from flask import Flask, Response, stream_with_context
+
+from cache import MemoryCacheBackend, ResponseCache
+
+
+class FixedVersion:
+    def current(self):
+        return 1
+
+
+def make_app(max_stream_bytes):
+    app = Flask(__name__)
+    cache = ResponseCache(MemoryCacheBackend(), FixedVersion(), max_stream_bytes)
+    calls = []
+
+    @app.route('/rows')
+    @cache.cached
+    def rows():
+        calls.append(1)
+        return Response(stream_with_context(f'"{index}",' for index in range(100)), mimetype='application/json')
+
+    client = app.test_client()
+
+    def get(path, **kwargs):
+        # Read while the request is current, as a server would send it
+        response = client.get(path, **kwargs)
+        response.get_data()
+        return response
+
+    return get, calls
+
+
+def test_streamed_responses_are_cached_once_complete():
+    get, calls = make_app(max_stream_bytes=1024 * 1024)
+    first = get('/rows')
+    second = get('/rows')
+
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert first.data == second.data
+    assert len(calls) == 1
+    assert get('/rows', headers={"If-None-Match": second.headers["ETag"]}).status_code == 304
+
+
+def test_large_streamed_responses_are_not_cached():
+    get, calls = make_app(max_stream_bytes=100)
+    first = get('/rows')
+    second = get('/rows')
+
+    assert second.headers["X-Cache"] == "MISS"
+    assert first.data == second.data
+    assert len(calls) == 2
@@ -0,0 +1,39 @@
+import pytest
+
+
+def test_upsert_derives_fields_from_the_merged_listing():
+    mongomock = pytest.importorskip("mongomock")
+    import db
+
+    db.db_manager.client = mongomock.MongoClient()
+    listing = {"url": "https://www.airbnb.com/rooms/1", "title": "Cabin", "price": "$100 night",
+               "location": "Whitehorse, Yukon, Canada"}
+    db.db_manager.upsert_many("test", "listings", [{**listing, "region": "Yukon", "country": "Canada"}])
+    db.db_manager.upsert_many("test", "listings", [{**listing, "price": "$120 night"}])
+
+    stored = db.db_manager.get_collection("test", "listings").find_one({"url": listing["url"]})
+    assert stored["region_norm"] == "yukon"
+    assert stored["country_norm"] == "canada"
+    assert stored["price_value"] == 120.0
+
+
+def test_canonicalize_urls_merges_query_string_copies():
+    mongomock = pytest.importorskip("mongomock")
+    import db
+
+    db.db_manager.client = mongomock.MongoClient()
+    listings = db.db_manager.get_collection("canon", "listings")
+    canonical = "https://www.airbnb.com/rooms/1"
+    listings.insert_many([{"url": canonical + "?adults=2", "title": "old"},
+                          {"url": canonical, "title": "newer"},
+                          {"url": "https://www.airbnb.com/rooms/2?check_in=2024-01-01", "title": "only"}])
+    frontier = db.db_manager.get_collection("canon", db.FRONTIER_COLLECTION)
+    frontier.insert_many([{"_id": canonical + "?adults=2", "state": "failed"},
+                          {"_id": canonical, "state": "done"},
+                          {"_id": "https://www.airbnb.com/rooms/2?check_in=2024-01-01", "state": "pending"}])
+
+    assert db.db_manager.canonicalize_urls("canon", "listings", batch_size=1) == (1, 1)
+    assert {(doc["url"], doc["title"]) for doc in listings.find()} == {
+        (canonical, "newer"), ("https://www.airbnb.com/rooms/2", "only")}
+    assert {(doc["_id"], doc["state"]) for doc in frontier.find()} == {
+        (canonical, "done"), ("https://www.airbnb.com/rooms/2", "pending")}
@@ -0,0 +1,19 @@
+import extract
+from selector_registry import SELECTORS
+
+BARE_PAGE = "<html><head><title>Airbnb</title></head><body><div id='root'></div></body></html>"
+
+
+def test_http_pages_leave_selector_health_alone():
+    before = SELECTORS.stats()
+    for index in range(50):
+        assert extract.extract_place_from_http(BARE_PAGE, f"https://www.airbnb.com/rooms/{index}") is None
+    assert SELECTORS.stats() == before
+    assert SELECTORS.healthy("price")
+
+
+def test_offer_prices_keep_their_currency():
+    assert extract.offer_price({"price": 120}) == "$120"
+    assert extract.offer_price({"price": "120", "priceCurrency": "CAD"}) == "CA$120"
+    assert extract.offer_price({"price": 95, "priceCurrency": "eur"}) == "€95"
+    assert extract.offer_price({"price": 80, "priceCurrency": "AUD"}) == "80 AUD"
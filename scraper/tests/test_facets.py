@@ -0,0 +1,35 @@
+import pytest
+
+from facets import facet_delta
+
+
+def test_new_listing_adds_its_facets():
+    delta = facet_delta({}, [{"url": "u", "region": "Yukon", "country": "Canada", "features": ["Wifi"]}])
+    assert delta == {("region", "Yukon"): 1, ("country", "Canada"): 1, ("feature", "Wifi"): 1}
+
+
+def test_changed_fields_move_counts():
+    old = {"u": {"url": "u", "region": "Yukon", "country": "Canada", "features": ["Wifi", "Pool"]}}
+    delta = facet_delta(old, [{"url": "u", "region": "Alberta", "country": "Canada", "features": ["Wifi"]}])
+    assert delta == {("region", "Yukon"): -1, ("region", "Alberta"): 1, ("feature", "Pool"): -1}
+
+
+def test_fields_missing_from_the_write_are_kept():
+    # A city scrape writes no region or country
+    old = {"u": {"url": "u", "region": "Yukon", "country": "Canada", "features": ["Wifi"]}}
+    assert facet_delta(old, [{"url": "u", "features": ["Wifi"]}]) == {}
+
+
+def test_upsert_keeps_facets_of_fields_missing_from_the_write():
+    mongomock = pytest.importorskip("mongomock")
+    import db
+
+    db.db_manager.client = mongomock.MongoClient()
+    listing = {"url": "https://www.airbnb.com/rooms/1", "title": "Cabin", "price": "$100 night",
+               "location": "Whitehorse, Yukon, Canada", "features": ["Wifi"]}
+    db.db_manager.upsert_many("test", "listings", [{**listing, "region": "Yukon", "country": "Canada"}])
+    db.db_manager.upsert_many("test", "listings", [listing])
+
+    catalogue = db.db_manager.get_facet_catalogue("test")
+    assert catalogue["regions"] == {"Yukon": 1}
+    assert catalogue["countries"] == {"Canada": 1}
@@ -0,0 +1,91 @@
+import re
+
+import pytest
+
+from benchmarks.fixture_server import FixtureHandler, FixtureServer
+from fetchers import HttpFetcher
+from pool import TaskFailed
+
+STRING_LD_PAGE = b"<html><script type='application/ld+json'>\"listing\"</script><h1>Loft</h1></html>"
+BARE_PAGE = b"<html><head><title>Airbnb</title></head><body><div id='root'></div></body></html>"
+
+
+class StubHandler(FixtureHandler):
+    # The fixture site, plus listing pages that render client-side only and
+    # listing pages that fail
+    def do_GET(self):
+        if re.match(r"^/bare/\d+", self.path):
+            return self.respond("text/html; charset=utf-8", BARE_PAGE)
+        if re.match(r"^/broken/\d+", self.path):
+            return self.send_error(500)
+        if re.match(r"^/undecodable/\d+", self.path):
+            return self.respond("text/html; charset=utf-8", b"<html>\xff\xfe\xfa</html>")
+        if re.match(r"^/string-ld/\d+", self.path):
+            return self.respond("text/html; charset=utf-8", STRING_LD_PAGE)
+        return super().do_GET()
+
+
+class FakeFetcher:
+    def __init__(self):
+        self.urls = []
+
+    def fetch_many(self, urls):
+        self.urls.extend(urls)
+        for url in urls:
+            yield url, {"url": url, "title": "Rendered", "price": "$1"}
+
+
+@pytest.fixture
+def server():
+    server = FixtureServer()
+    server.server.RequestHandlerClass = StubHandler
+    with server:
+        yield server
+
+
+def test_parses_server_rendered_pages(server):
+    urls = [server.url(f"/rooms/{room_id}") for room_id in (101, 102, 103)]
+    results = dict(HttpFetcher(concurrency=2).fetch_many(urls))
+
+    assert set(results) == set(urls)
+    place = results[server.url("/rooms/101")]
+    assert place["title"] == "Bright loft 101 near the water"
+    assert place["price"] == "$1,601 month"
+    assert place["location"] == "Toronto, Ontario, Canada"
+
+
+def test_pages_missing_required_fields_go_to_fallback(server):
+    fallback = FakeFetcher()
+    good, bare = server.url("/rooms/101"), server.url("/bare/102")
+    results = dict(HttpFetcher(fallback=fallback).fetch_many([good, bare]))
+
+    assert fallback.urls == [bare]
+    assert results[good]["title"] == "Bright loft 101 near the water"
+    assert results[bare]["title"] == "Rendered"
+
+
+def test_http_errors_become_task_failed(server):
+    urls = [server.url("/broken/1"), server.url("/missing")]
+    results = dict(HttpFetcher().fetch_many(urls))
+
+    assert set(results) == set(urls)
+    assert all(isinstance(result, TaskFailed) for result in results.values())
+    assert results[urls[0]].item == urls[0]
+
+
+def test_http_errors_go_to_fallback_too(server):
+    fallback = FakeFetcher()
+    url = server.url("/broken/1")
+    results = dict(HttpFetcher(fallback=fallback).fetch_many([url]))
+
+    assert fallback.urls == [url]
+    assert results[url]["title"] == "Rendered"
+
+
+def test_bad_pages_fail_alone(server):
+    good = server.url("/rooms/101")
+    bad = [server.url("/undecodable/1"), server.url("/string-ld/2")]
+    results = dict(HttpFetcher().fetch_many([good] + bad))
+
+    assert results[good]["title"] == "Bright loft 101 near the water"
+    assert all(isinstance(results[url], TaskFailed) for url in bad)
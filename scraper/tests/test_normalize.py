@@ -0,0 +1,45 @@
+import pytest
+
+from normalize import parse_house_details, parse_price, parse_rating
+
+
+@pytest.mark.parametrize("text, value, currency, period", [
+    ("$1,234 month", 1234.0, "USD", "month"),
+    ("$120 x 5 nights", 120.0, "USD", "night"),
+    ("$150 night · $1,050 total", 150.0, "USD", "night"),
+    ("$1,500 $1,234 month", 1234.0, "USD", "month"),
+    ("CA$99 / night", 99.0, "CAD", "night"),
+    ("120 € per night", 120.0, "EUR", "night"),
+    ("$1,050 total", 1050.0, "USD", "total"),
+    ("$85", 85.0, "USD", None),
+    ("ca$100 night", 100.0, "CAD", "night"),
+    ("us$5", 5.0, "USD", None),
+    ("1,234 month", None, None, None),
+    ("", None, None, None),
+    (None, None, None, None),
+])
+def test_parse_price(text, value, currency, period):
+    assert parse_price(text) == {"price_value": value, "price_currency": currency, "price_period": period}
+
+
+@pytest.mark.parametrize("text, value, reviews", [
+    ("4.92 · 120 reviews", 4.92, 120),
+    ("4.85 (32)", 4.85, 32),
+    ("5.0 (12)", 5.0, 12),
+    ("★5 · 3 reviews", 5.0, 3),
+    ("5", 5.0, None),
+    ("3 reviews", None, 3),
+    ("1 review", None, 1),
+    ("(3)", None, 3),
+    ("New", None, None),
+    (None, None, None),
+])
+def test_parse_rating(text, value, reviews):
+    assert parse_rating(text) == {"rating_value": value, "review_count": reviews}
+
+
+def test_parse_house_details():
+    assert parse_house_details(["16+ guests", "8 bedrooms", "10 beds", "4.5 baths"]) == {
+        "bedrooms": 8.0, "beds": 10.0, "baths": 4.5, "guests": 16.0}
+    assert parse_house_details(["Studio", "1 bed", "Half-bath"]) == {
+        "bedrooms": 0.0, "beds": 1.0, "baths": 0.5, "guests": None}
@@ -0,0 +1,224 @@
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from fnmatch import fnmatch
+from urllib.parse import urljoin, urlsplit
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails are stored under their own SHA-256, so a file never changes once
+# written and can be cached by clients indefinitely. Least recently served
+# files are removed once the cache outgrows THUMBNAIL_CACHE_MAX_MB.
+THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        'thumbnail_cache'))
+THUMBNAIL_CACHE_MAX_MB = float(os.getenv('THUMBNAIL_CACHE_MAX_MB', 1024))
+THUMBNAIL_SIZE = tuple(int(side) for side in os.getenv('THUMBNAIL_SIZE', '360x240').split('x'))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+# Limits on fetching the original image
+THUMBNAIL_FETCH_TIMEOUT = float(os.getenv('THUMBNAIL_FETCH_TIMEOUT', 10))
+THUMBNAIL_MAX_SOURCE_MB = float(os.getenv('THUMBNAIL_MAX_SOURCE_MB', 20))
+# Hosts pictures may be fetched from, redirects included, as comma-separated
+# patterns; picture URLs are scraped, so anything else is refused
+THUMBNAIL_ALLOWED_HOSTS = [host.strip().lower() for host in
+                           os.getenv('THUMBNAIL_ALLOWED_HOSTS', 'a0.muscache.com,*.muscache.com').split(',')
+                           if host.strip()]
+# Listings waiting for a thumbnail in the background; beyond that they get one
+# on first request instead
+THUMBNAIL_PREFETCH = os.getenv('THUMBNAIL_PREFETCH', 'true').lower() == 'true'
+THUMBNAIL_QUEUE_SIZE = int(os.getenv('THUMBNAIL_QUEUE_SIZE', 1000))
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0 Safari/537.36"
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def check_image_url(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise ThumbnailError(f"not an http(s) image URL: {url}")
+    host = (parts.hostname or "").lower()
+    if not any(fnmatch(host, pattern) for pattern in THUMBNAIL_ALLOWED_HOSTS):
+        raise ThumbnailError(f"{host or url} is not an allowed image host")
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # A redirect may only lead to another allowed image host
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_image_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+image_opener = urllib.request.build_opener(CheckedRedirectHandler)
+
+
+def fetch_image(url):
+    check_image_url(url)
+    limit = int(THUMBNAIL_MAX_SOURCE_MB * 1024 * 1024)
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    try:
+        with image_opener.open(request, timeout=THUMBNAIL_FETCH_TIMEOUT) as response:
+            data = response.read(limit + 1)
+    except OSError as e:
+        raise ThumbnailError(f"could not fetch {url}: {e}")
+    if len(data) > limit:
+        raise ThumbnailError(f"{url} is larger than {THUMBNAIL_MAX_SOURCE_MB:g} MB")
+    return data
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    # Cropped to exactly size, so grid cells line up
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Lets JPEG decoding skip straight to a scale near the target
+            image.draft("RGB", (size[0] * 2, size[1] * 2))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            thumbnail = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ThumbnailError(f"not a usable image: {e}")
+    output = io.BytesIO()
+    thumbnail.save(output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, directory=THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.jpg")
+
+    def files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_atime, stat.st_size
+
+    def get(self, digest):
+        # The access time records when it was last served, whatever the mount
+        # options; the modification time stays when it was made
+        path = self.path(digest)
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            return None
+        return path
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name so readers never see half a file
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, _, size in self.files())
+            else:
+                self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+        return digest
+
+    def evict(self):
+        # Least recently served first, down to 90% of the limit so eviction
+        # doesn't run on every write
+        target = self.max_bytes * 0.9
+        removed = 0
+        for path, _, size in sorted(self.files(), key=lambda item: item[1]):
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            removed += 1
+        logger.info(f"Evicted {removed} thumbnails, cache now {self.size / 1024 / 1024:.1f} MB")
+
+
+class Thumbnailer:
+    # Makes and finds the thumbnail of a listing's picture_url. The digest and
+    # the URL it was made from are kept on the listing, so a new picture gets
+    # a new thumbnail.
+    def __init__(self, db_name, collection_name, cache=None):
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.cache = cache or ThumbnailCache()
+
+    def source_url(self, listing):
+        picture_url = listing.get("picture_url")
+        return urljoin(listing.get("url") or "", picture_url) if picture_url else None
+
+    def cached(self, listing):
+        # Path of the listing's current thumbnail, or None
+        if listing.get("thumbnail") and listing.get("thumbnail_source") == listing.get("picture_url"):
+            return self.cache.get(listing["thumbnail"])
+        return None
+
+    def ensure(self, listing):
+        # Digest of the listing's thumbnail, made now if needed. Raises
+        # ThumbnailError when the picture can't be fetched or decoded.
+        if self.cached(listing):
+            return listing["thumbnail"]
+        url = self.source_url(listing)
+        if not url:
+            raise ThumbnailError(f"{listing.get('url')} has no picture")
+        digest = self.cache.put(make_thumbnail(fetch_image(url)))
+        db.set_thumbnail(self.db_name, self.collection_name, listing["url"], digest, listing["picture_url"])
+        return digest
+
+
+class ThumbnailPrefetcher(threading.Thread):
+    # Makes thumbnails of freshly written listings in the background, so most
+    # are ready before anyone asks. Does nothing until started.
+    def __init__(self, thumbnailer, max_pending=THUMBNAIL_QUEUE_SIZE):
+        super().__init__(name="thumbnail-prefetcher", daemon=True)
+        self.thumbnailer = thumbnailer
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.made = 0
+        self.failed = 0
+
+    def submit(self, listings):
+        if not self.is_alive():
+            return
+        for listing in listings:
+            try:
+                self.queue.put_nowait(listing)
+            except queue.Full:
+                return
+
+    def run(self):
+        while True:
+            listing = self.queue.get()
+            try:
+                # A re-scraped listing may already have a thumbnail of the same picture
+                stored = db.get_thumbnail_state(self.thumbnailer.db_name, self.thumbnailer.collection_name,
+                                                listing["url"])
+                self.thumbnailer.ensure(stored or listing)
+                self.made += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"No thumbnail for {listing.get('url')}: {e}")
+
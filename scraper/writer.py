@@ -0,0 +1,126 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A batch is flushed once it holds WRITE_BATCH_SIZE listings or its oldest
+# listing has waited WRITE_FLUSH_INTERVAL seconds. At most WRITE_QUEUE_SIZE
+# listings wait to be written; beyond that put() blocks the scrapers.
+WRITE_BATCH_SIZE = int(os.getenv('SCRAPER_WRITE_BATCH_SIZE', 50))
+WRITE_FLUSH_INTERVAL = float(os.getenv('SCRAPER_WRITE_FLUSH_INTERVAL', 10))
+WRITE_QUEUE_SIZE = int(os.getenv('SCRAPER_WRITE_QUEUE_SIZE', 500))
+# Region rollups touched by written listings are recomputed at most this often,
+# and once more when the writer closes
+ROLLUP_REFRESH_INTERVAL = float(os.getenv('ROLLUP_REFRESH_INTERVAL', 60))
+
+_STOP = object()
+
+
+class ListingWriter(threading.Thread):
+    # Streams scraped place dicts to MongoDB as unordered bulk upserts. Written
+    # URLs are marked done in the crawl frontier, and on_flush(batch, ids) is
+    # called from the writer thread after every successful batch.
+    def __init__(self, db_name, collection_name, on_flush=None, batch_size=WRITE_BATCH_SIZE,
+                 flush_interval=WRITE_FLUSH_INTERVAL, max_pending=WRITE_QUEUE_SIZE):
+        super().__init__(name="listing-writer", daemon=True)
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.db_manager = db.db_manager
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.rollups_refreshed = time.monotonic()
+
+    def put(self, place):
+        self.queue.put(place)
+
+    def run(self):
+        batch = []
+        batch_started = None
+        stopping = False
+        while not stopping:
+            timeout = None
+            if batch:
+                timeout = max(0.0, batch_started + self.flush_interval - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    if not batch:
+                        batch_started = time.monotonic()
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch and (stopping or len(batch) >= self.batch_size
+                          or time.monotonic() - batch_started >= self.flush_interval):
+                self.flush(batch)
+                batch = []
+
+    def flush(self, batch):
+        start = time.monotonic()
+        try:
+            ids = self.db_manager.upsert_many(self.db_name, self.collection_name, batch)
+            self.db_manager.mark_frontier(self.db_name, [place['url'] for place in batch], "done")
+        except Exception as e:
+            # The URLs stay pending in the frontier and are picked up by the next run
+            self.failed += len(batch)
+            metrics.LISTING_WRITE_FAILURES.inc(len(batch))
+            logger.error(f"Failed to write a batch of {len(batch)} listings: {e}")
+            return
+
+        latency = time.monotonic() - start
+        metrics.STAGE_SECONDS.observe(latency, stage="db_write")
+        metrics.LISTINGS_WRITTEN.inc(len(ids))
+        self.batches += 1
+        self.written += len(ids)
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        logger.info(f"Wrote {len(ids)} listings in {latency * 1000:.0f} ms "
+                    f"({self.queue.qsize()} waiting)")
+        if self.on_flush:
+            self.on_flush(batch, ids)
+        if time.monotonic() - self.rollups_refreshed >= ROLLUP_REFRESH_INTERVAL:
+            self.refresh_rollups()
+
+    def refresh_rollups(self):
+        self.rollups_refreshed = time.monotonic()
+        try:
+            self.db_manager.refresh_rollups(self.db_name, self.collection_name)
+        except Exception as e:
+            logger.error(f"Failed to refresh rollups: {e}")
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.join()
+        self.refresh_rollups()
+        logger.info(f"Listing writer finished: {self.stats()}")
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "avg_batch_ms": round(self.total_latency / self.batches * 1000, 1) if self.batches else 0.0,
+            "max_batch_ms": round(self.max_latency * 1000, 1),
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
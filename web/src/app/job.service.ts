@@ -0,0 +1,29 @@
+import { Injectable } from '@angular/core';
+import { HttpClient } from '@angular/common/http';
+import { Observable, timer } from 'rxjs';
+import { filter, switchMap, take } from 'rxjs/operators';
+
+@Injectable({
+  providedIn: 'root'
+})
+export class JobService {
+  private apiUrl = 'http://localhost:5000';  // Make sure this matches your Flask server address
+  private pollInterval = 5000;
+  private finished = ['completed', 'failed', 'cancelled'];
+
+  constructor(private http: HttpClient) {}
+
+  getJob(jobId: string): Observable<any> {
+    return this.http.get(`${this.apiUrl}/jobs/${jobId}`);
+  }
+
+  // The scrape endpoints answer 202 with a job id when the job outlives the
+  // request; this polls the job until it has finished and emits it once
+  waitForJob(jobId: string): Observable<any> {
+    return timer(this.pollInterval, this.pollInterval).pipe(
+      switchMap(() => this.getJob(jobId)),
+      filter((job: any) => this.finished.includes(job.status)),
+      take(1)
+    );
+  }
+}
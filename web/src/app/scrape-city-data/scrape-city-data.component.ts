@@ -4,13 +4,14 @@ import { FormsModule } from "@angular/forms";
 import {NgIf, NgFor, KeyValuePipe, TitleCasePipe, NgClass} from "@angular/common";
 import { HttpClientModule } from '@angular/common/http';
 import { ListingService } from '../listings.service';
+import { JobService } from '../job.service';
 
 
 @Component({
   selector: 'app-scrape-city-data',
   standalone: true,
   imports: [NgIf, NgFor, KeyValuePipe, TitleCasePipe, FormsModule, HttpClientModule, NgClass],
-  providers: [ListingService, CityDataService],
+  providers: [ListingService, CityDataService, JobService],
   template: `
     <div class="scrape-container">
       <h2 class="scrape-title">Scrape Airbnb Listings</h2>
@@ -50,12 +51,27 @@ export class ScrapeCityDataComponent {
   cityData: any;
   scrapeMessage: string = '';
 
-  constructor(private cityDataService: CityDataService, private listingService: ListingService) {}
+  constructor(private cityDataService: CityDataService, private listingService: ListingService,
+              private jobService: JobService) {}
 
   scrapeCityData() {
     if (this.cityName) {
-      this.cityDataService.scrapeCityData(this.cityName).subscribe(
+      const city = this.cityName;
+      this.scrapeMessage = '';
+      this.cityDataService.scrapeCityData(city).subscribe(
         data => {
+          if (data.job_id && !data.places) {
+            // Still running on the server: wait for the job, then show what it stored
+            this.scrapeMessage = `Scraping ${city} is still running...`;
+            this.jobService.waitForJob(data.job_id).subscribe(
+              job => this.showCityJob(city, job),
+              error => {
+                console.error('Error checking the scrape job:', error);
+                this.scrapeMessage = 'Could not check on the scrape. Please try again later.';
+              }
+            );
+            return;
+          }
           this.cityData = data;
         },
         error => {
@@ -71,7 +87,23 @@ export class ScrapeCityDataComponent {
     this.listingService.scrapeNorthAmerica().subscribe(
       (response: any) => {
         console.log('Scrape response:', response);
-        this.scrapeMessage = `Scraping completed. ${response.total_listings} listings added (${response.canada_listings} from Canada, ${response.us_listings} from USA).`;
+        if (response.job_id && response.total_listings === undefined) {
+          // The crawl outlives the request; report once the job has finished
+          this.scrapeMessage = 'Scraping is still running on the server... This may take a while.';
+          this.jobService.waitForJob(response.job_id).subscribe(
+            job => {
+              this.scrapeMessage = job.status === 'completed'
+                ? this.northAmericaSummary(job.result)
+                : `Scraping ${job.status}. ${job.error || ''}`.trim();
+            },
+            error => {
+              console.error('Error checking the scrape job:', error);
+              this.scrapeMessage = 'Could not check on the scrape. Please try again later.';
+            }
+          );
+          return;
+        }
+        this.scrapeMessage = this.northAmericaSummary(response);
       },
       error => {
         console.error('Error during scraping:', error);
@@ -79,4 +111,25 @@ export class ScrapeCityDataComponent {
       }
     );
   }
+
+  private northAmericaSummary(result: any): string {
+    return `Scraping completed. ${result.total_listings} listings added (${result.canada_listings} from Canada, ${result.us_listings} from USA).`;
+  }
+
+  private showCityJob(city: string, job: any) {
+    if (job.status !== 'completed') {
+      this.scrapeMessage = `Scraping ${city} ${job.status}. ${job.error || ''}`.trim();
+      return;
+    }
+    this.scrapeMessage = '';
+    this.cityDataService.getListings(city, Math.max(job.result.listings, 10)).subscribe(
+      places => {
+        this.cityData = {city: city, places: places};
+      },
+      error => {
+        console.error('Error loading scraped listings:', error);
+        this.scrapeMessage = 'Scraping completed, but the listings could not be loaded.';
+      }
+    );
+  }
 }